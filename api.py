@@ -1,6 +1,23 @@
-import duckdb
 import json
-from fastapi import FastAPI
+from typing import Annotated, Literal, Optional
+from contextlib import asynccontextmanager
+from fastapi import Body, FastAPI, Form, Header, HTTPException, Query, UploadFile
+import competition
+import competitors
+import db
+import demographics
+import formats
+import ingest
+import listings
+from listings import ListingUpdate
+from cache import QueryCache
+from executors import QueryExecutors
+import proximity
+import queries
+from queries import Area, District, PageSize, Rank, Rent
+import rollup
+import scoring
+import snapshot
 
 
 """
@@ -9,333 +26,346 @@ from fastapi import FastAPI
 """
 with open('connection_setting.json', 'r') as f:
     settings = json.load(f)
-con = duckdb.connect('')
-con.sql("INSTALL postgres;LOAD postgres;")
-con.sql(f"""
-CREATE or replace SECRET (
-    TYPE POSTGRES,
-    HOST '{settings['host']}',
-    PORT {settings['port']},
-    DATABASE '{settings['database']}',
-    USER '{settings['user']}',
-    PASSWORD '{settings['password']}'
-);
-""")
-con.sql("ATTACH '' AS pg (TYPE POSTGRES);")
+pool = db.ConnectionPool(settings)
+# 查詢結果快取，寫入資料表後以 result_cache.invalidate(<table>) 淘汰依賴該表的結果
+result_cache = QueryCache(
+    ttl_seconds=settings.get('cache_ttl_seconds', 300),
+    max_bytes=settings.get('cache_max_mb', 64) * 1024 * 1024,
+)
+# 端點的查詢依 heavy / light 交給各自的執行緒池執行
+executors = QueryExecutors(pool, settings)
 
 """
 以下利用 FastAPI 撰寫 api 並在後續進行 server 和 client 的串接，FastAPI 提供簡單的語法糖，讓我們可以將原先寫好的 fn 進一步包裝為 api
+server 啟動時掛載本地 duckdb 檔案，建立店面與車站的鄰近關係表並更新人潮彙總表，各端點直接 JOIN 這些表而不需重算
+查詢一律讀取 src.<table>，依 snapshot 設定指向本地快照或 pgsql；寫入則直接寫到 pg.<table>
 """
-app = FastAPI()
+def after_snapshot_refresh(cur, tables):
+    # tables 為更新或切換讀取來源的表；車站或店面的來源變動時重建鄰近關係，其餘彙總表接著依鄰近關係重算
+    # 快照與彙總表更新後，先前快取的結果都可能過時
+    with db.refresh_lock:
+        if set(tables) & set(proximity.SOURCE_TABLES):
+            proximity.build(cur)
+        rollup.refresh_all(cur)
+        demographics.refresh(cur)
+        competition.refresh(cur)
+        competitors.reset()
+        result_cache.clear()
+
+def after_rollup_refresh(cur):
+    result_cache.invalidate('MRT_Flow_Record', 'Ubike_Station_Rental_Record')
+
+@asynccontextmanager
+async def lifespan(app):
+    with pool.cursor() as cur, db.refresh_lock:
+        cur.sql(f"ATTACH IF NOT EXISTS '{settings.get('local_database', 'smartrent.duckdb')}' AS local")
+        snapshot.setup(cur, settings.get('snapshot_tables', snapshot.DEFAULT_SNAPSHOT_TABLES))
+        proximity.build(cur)
+        rollup.refresh_all(cur)
+        demographics.refresh(cur)
+        competition.refresh(cur)
+    if settings.get('snapshot_interval_minutes'):
+        snapshot.start_scheduler(pool, settings['snapshot_interval_minutes'], after_refresh=after_snapshot_refresh)
+    if settings.get('rollup_interval_minutes'):
+        rollup.start_scheduler(pool, settings['rollup_interval_minutes'], after_refresh=after_rollup_refresh)
+    yield
+    executors.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/organization_data")
-def get_organization_data(district = None):
+@executors.heavy()
+@result_cache.cached('organization_data', tables=('Shop_Rental_Listing', 'MRT_Station_Info', 'MRT_Business_Area'))
+def get_organization_data(district: District = None):
     # 檢查使用者是否勾選 district，若有則根據選擇的區域回傳，否則回傳全部
-    where_clause = f"WHERE district = '{district}'" if district else ""
-    
-    res = con.sql(f"""--sql
-        WITH nearest_stations AS (
+    # 每個店面只歸到 1 公里內最近的一個捷運站，平均租金不會因為附近有多個車站而重複計入
+    with pool.cursor() as cur:
+        json = queries.records(cur, """--sql
+            WITH nearest_stations AS (
+                SELECT 
+                    s.district,
+                    s.case_name,
+                    s.address,
+                    s.monthly_rent,
+                    s.area_ping,
+                    m.station_id,
+                    m.station_name,
+                    n.distance_km AS nearest_distance_km
+                FROM local.listing_nearest_station n
+                JOIN src.shop_rental_listing s ON s.case_id = n.case_id
+                JOIN src.MRT_Station_Info m ON m.station_id::VARCHAR = n.station_id
+                WHERE n.station_kind = 'mrt' AND n.rank = 1 AND n.distance_km <= $radius
+                  AND ($district IS NULL OR s.district = $district)
+            )
             SELECT 
-                s.district,
-                s.case_name,
-                s.address,
-                s.monthly_rent,
-                s.area_ping,
-                m.station_id,
-                m.station_name,
-                MIN(
-                    6371 * ACOS(
-                        COS(RADIANS(s.latitude)) * COS(RADIANS(m.latitude)) *
-                        COS(RADIANS(m.longitude) - RADIANS(s.longitude)) +
-                        SIN(RADIANS(s.latitude)) * SIN(RADIANS(m.latitude))
-                    )
-                ) AS nearest_distance_km
-            FROM pg.shop_rental_listing s
-            CROSS JOIN pg.MRT_Station_Info m
-            GROUP BY s.district, s.case_name, s.address, s.monthly_rent, s.area_ping, m.station_id, m.station_name
-            HAVING nearest_distance_km <= 1
-        )
-        SELECT 
-            mba.name , -- 商圈名稱
-            ROUND(AVG(ns.monthly_rent)) AS average_monthly_rent,
-            ns.station_name,
-            mba.tag ,
-            ns.district
-        FROM nearest_stations ns
-        JOIN pg.MRT_Business_Area mba ON ns.station_id = mba.station_id -- 加入商圈數據
-        {where_clause} -- 動態加入條件
-        GROUP BY mba.name, mba.tag, ns.station_name, ns.district
-        ORDER BY ns.district, ns.station_name; 
-        """)
-    json = res.df().to_dict(orient="records")
+                mba.name , -- 商圈名稱
+                ROUND(AVG(ns.monthly_rent)) AS average_monthly_rent,
+                ns.station_name,
+                mba.tag ,
+                ns.district
+            FROM nearest_stations ns
+            JOIN src.MRT_Business_Area mba ON ns.station_id = mba.station_id -- 加入商圈數據
+            GROUP BY mba.name, mba.tag, ns.station_name, ns.district
+            ORDER BY ns.district, ns.station_name; 
+            """, {'district': district, 'radius': proximity.NEARBY_RADIUS_KM})
     return json
 
 @app.get("/show_flow_data")
-def get_shop_flow_data(case_id=None):
-    # 動態構建 WHERE 條件
-    conditions = []
-    if case_id:
-        conditions.append(f"cf.case_id = '{case_id}'")
-    
-    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-    
-    res = con.sql(f"""--sql
-    WITH mrt_distances AS (
-        SELECT
-            s.case_id,
-            s.district,
-            s.village,
-            s.case_name,
-            m.station_id AS mrt_station_id,
-            (
-                6371 * ACOS(
-                    COS(RADIANS(s.latitude)) * COS(RADIANS(m.latitude)) *
-                    COS(RADIANS(m.longitude) - RADIANS(s.longitude)) +
-                    SIN(RADIANS(s.latitude)) * SIN(RADIANS(m.latitude))
-                )
-            ) AS mrt_distance_km
-        FROM pg.Shop_Rental_Listing s
-        CROSS JOIN pg.MRT_Station_Info m
-    ),
-    ubike_distances AS (
-        SELECT
-            s.case_id,
-            s.district,
-            s.village,
-            s.case_name,
-            u.station_id AS ubike_station_id,
-            (
-                6371 * ACOS(
-                    COS(RADIANS(s.latitude)) * COS(RADIANS(u.latitude)) *
-                    COS(RADIANS(u.longitude) - RADIANS(s.longitude)) +
-                    SIN(RADIANS(s.latitude)) * SIN(RADIANS(u.latitude))
-                )
-            ) AS ubike_distance_km
-        FROM pg.Shop_Rental_Listing s
-        CROSS JOIN pg.Ubike_Station_Info u
-    ),
-    mrt_nearest_stations AS (
-        SELECT 
-            d.case_id,
-            d.district,
-            d.case_name,
-            d.village,
-            d.mrt_station_id
-        FROM mrt_distances d
-        WHERE d.mrt_distance_km <= 1
-    ),
-    ubike_nearest_stations AS (
-        SELECT 
-            d.case_id,
-            d.district,
-            d.case_name,
-            d.village,
-            d.ubike_station_id
-        FROM ubike_distances d
-        WHERE d.ubike_distance_km <= 1
-    ),
-    -- 不在此處過濾時段，使 MRT flow 保留所有時段
-    mrt_flow_data AS (
-        SELECT
-            mf.station_id AS mrt_station_id, 
-            mf.time_period,
-            ROUND(AVG(mf.entrance_count + mf.exit_count)) AS avg_mrt_flow
-        FROM pg.MRT_Flow_Record mf
-        WHERE mf.date >= CURRENT_DATE - INTERVAL '2 years' AND time_period NOT BETWEEN 2 AND 5
-        GROUP BY mf.station_id, mf.time_period
-    ),
-    ubike_flow_data AS (
-        SELECT
-            uf.station_id AS ubike_station_id,
-            uf.time_period,
-            ROUND(AVG(uf.rent_count + uf.return_count)) AS avg_ubike_flow
-        FROM pg.Ubike_Station_Rental_Record uf
-        WHERE uf.date >= CURRENT_DATE - INTERVAL '2 years'
-        GROUP BY uf.station_id, uf.time_period
-    ),
-    -- 將 mrt_nearest_stations 與 mrt_flow_data JOIN，彙整出以 case_id 為單位的 MRT flow 資料
-    mrt_case_flow AS (
-        SELECT
-            mrt.case_id,
-            mrt.district,
-            mrt.case_name,
-            mrt.village,
-            mf.time_period,
-            AVG(mf.avg_mrt_flow) AS avg_mrt_flow
-        FROM mrt_nearest_stations mrt
-        JOIN mrt_flow_data mf ON mf.mrt_station_id = mrt.mrt_station_id
-        GROUP BY mrt.case_id, mrt.district, mrt.case_name, mrt.village, mf.time_period
-    ),
-    -- 將 ubike_nearest_stations 與 ubike_flow_data JOIN，彙整出以 case_id 為單位的 Ubike flow 資料
-    ubike_case_flow AS (
-        SELECT
-            ubike.case_id,
-            ubike.district,
-            ubike.case_name,
-            ubike.village,
-            uf.time_period,
-            AVG(uf.avg_ubike_flow) AS avg_ubike_flow
-        FROM ubike_nearest_stations ubike
-        JOIN ubike_flow_data uf ON uf.ubike_station_id = ubike.ubike_station_id
-        GROUP BY ubike.case_id, ubike.district, ubike.case_name, ubike.village, uf.time_period
-    ),
-    -- FULL JOIN 將MRT與Ubike的case flow合併，確保沒有MRT資料的時段依然會出現
-    combined_flow AS (
-        SELECT
-            COALESCE(mcf.case_id, ucf.case_id) AS case_id,
-            COALESCE(mcf.district, ucf.district) AS district,
-            COALESCE(mcf.case_name, ucf.case_name) AS case_name,
-            COALESCE(mcf.village, ucf.village) AS village,
-            COALESCE(mcf.time_period, ucf.time_period) AS time_period,
-            ROUND(COALESCE(mcf.avg_mrt_flow,0) + COALESCE(ucf.avg_ubike_flow,0)) AS avg_total_flow
-        FROM mrt_case_flow mcf
-        FULL JOIN ubike_case_flow ucf 
-            ON mcf.case_id = ucf.case_id
-           AND mcf.time_period = ucf.time_period
-    ),
-    business_area_info AS (
+@executors.heavy(limit=2)
+@result_cache.cached('show_flow_data', tables=('Shop_Rental_Listing', 'MRT_Station_Info', 'Ubike_Station_Info', 'MRT_Business_Area', 'MRT_Flow_Record', 'Ubike_Station_Rental_Record'))
+def get_shop_flow_data(case_id: Optional[int] = None):
+    # 條件在一開始就套用到店面清單上，後續只計算這些店面附近車站的人潮
+    with pool.cursor() as cur:
+        json = queries.records(cur, """--sql
+        WITH listings AS (
+            SELECT s.case_id, s.district, s.case_name, s.village
+            FROM src.Shop_Rental_Listing s
+            WHERE $case_id IS NULL OR s.case_id = $case_id
+        ),
+        mrt_nearest_stations AS (
+            SELECT 
+                l.case_id,
+                l.district,
+                l.case_name,
+                l.village,
+                p.station_id AS mrt_station_id
+            FROM listings l
+            JOIN local.listing_station_proximity p ON p.case_id = l.case_id
+            WHERE p.station_kind = 'mrt'
+        ),
+        ubike_nearest_stations AS (
+            SELECT 
+                l.case_id,
+                l.district,
+                l.case_name,
+                l.village,
+                p.station_id AS ubike_station_id
+            FROM listings l
+            JOIN local.listing_station_proximity p ON p.case_id = l.case_id
+            WHERE p.station_kind = 'ubike'
+        ),
+        -- 不在此處過濾時段，使 MRT flow 保留所有時段；只彙整上面選出的車站
+        -- 近兩年的期間中，完整的月份讀每月彙總表，起始日所在的不完整月份 (起始日 ~ 下個月 1 日) 讀原始紀錄，
+        -- 合併兩部分的總和與筆數算出平均，與直接平均近兩年的原始紀錄相同；期間寫成常數運算式，日期條件可下推到掃描
+        mrt_flow_parts AS (
+            SELECT mf.station_id, mf.time_period, mf.flow_sum, mf.flow_cnt
+            FROM local.mrt_flow_hourly mf
+            WHERE mf.month >= date_trunc('month', CURRENT_DATE - INTERVAL '2 years' - INTERVAL '1 day') + INTERVAL '1 month'
+              AND mf.station_id IN (SELECT mrt_station_id FROM mrt_nearest_stations)
+            UNION ALL
+            SELECT mf.station_id::VARCHAR, mf.time_period, SUM(mf.entrance_count + mf.exit_count), COUNT(*)
+            FROM src.MRT_Flow_Record mf
+            WHERE mf.date >= CURRENT_DATE - INTERVAL '2 years'
+              AND mf.date < date_trunc('month', CURRENT_DATE - INTERVAL '2 years' - INTERVAL '1 day') + INTERVAL '1 month'
+              AND mf.station_id::VARCHAR IN (SELECT mrt_station_id FROM mrt_nearest_stations)
+            GROUP BY ALL
+        ),
+        mrt_flow_data AS (
+            SELECT
+                mf.station_id AS mrt_station_id, 
+                mf.time_period,
+                ROUND(SUM(mf.flow_sum) / SUM(mf.flow_cnt)) AS avg_mrt_flow
+            FROM mrt_flow_parts mf
+            WHERE time_period NOT BETWEEN 2 AND 5
+            GROUP BY mf.station_id, mf.time_period
+        ),
+        ubike_flow_parts AS (
+            SELECT uf.station_id, uf.time_period, uf.flow_sum, uf.flow_cnt
+            FROM local.ubike_flow_hourly uf
+            WHERE uf.month >= date_trunc('month', CURRENT_DATE - INTERVAL '2 years' - INTERVAL '1 day') + INTERVAL '1 month'
+              AND uf.station_id IN (SELECT ubike_station_id FROM ubike_nearest_stations)
+            UNION ALL
+            SELECT uf.station_id::VARCHAR, uf.time_period, SUM(uf.rent_count + uf.return_count), COUNT(*)
+            FROM src.Ubike_Station_Rental_Record uf
+            WHERE uf.date >= CURRENT_DATE - INTERVAL '2 years'
+              AND uf.date < date_trunc('month', CURRENT_DATE - INTERVAL '2 years' - INTERVAL '1 day') + INTERVAL '1 month'
+              AND uf.station_id::VARCHAR IN (SELECT ubike_station_id FROM ubike_nearest_stations)
+            GROUP BY ALL
+        ),
+        ubike_flow_data AS (
+            SELECT
+                uf.station_id AS ubike_station_id,
+                uf.time_period,
+                ROUND(SUM(uf.flow_sum) / SUM(uf.flow_cnt)) AS avg_ubike_flow
+            FROM ubike_flow_parts uf
+            GROUP BY uf.station_id, uf.time_period
+        ),
+        -- 將 mrt_nearest_stations 與 mrt_flow_data JOIN，彙整出以 case_id 為單位的 MRT flow 資料
+        mrt_case_flow AS (
+            SELECT
+                mrt.case_id,
+                mrt.district,
+                mrt.case_name,
+                mrt.village,
+                mf.time_period,
+                AVG(mf.avg_mrt_flow) AS avg_mrt_flow
+            FROM mrt_nearest_stations mrt
+            JOIN mrt_flow_data mf ON mf.mrt_station_id = mrt.mrt_station_id
+            GROUP BY mrt.case_id, mrt.district, mrt.case_name, mrt.village, mf.time_period
+        ),
+        -- 將 ubike_nearest_stations 與 ubike_flow_data JOIN，彙整出以 case_id 為單位的 Ubike flow 資料
+        ubike_case_flow AS (
+            SELECT
+                ubike.case_id,
+                ubike.district,
+                ubike.case_name,
+                ubike.village,
+                uf.time_period,
+                AVG(uf.avg_ubike_flow) AS avg_ubike_flow
+            FROM ubike_nearest_stations ubike
+            JOIN ubike_flow_data uf ON uf.ubike_station_id = ubike.ubike_station_id
+            GROUP BY ubike.case_id, ubike.district, ubike.case_name, ubike.village, uf.time_period
+        ),
+        -- FULL JOIN 將MRT與Ubike的case flow合併，確保沒有MRT資料的時段依然會出現
+        combined_flow AS (
+            SELECT
+                COALESCE(mcf.case_id, ucf.case_id) AS case_id,
+                COALESCE(mcf.district, ucf.district) AS district,
+                COALESCE(mcf.case_name, ucf.case_name) AS case_name,
+                COALESCE(mcf.village, ucf.village) AS village,
+                COALESCE(mcf.time_period, ucf.time_period) AS time_period,
+                ROUND(COALESCE(mcf.avg_mrt_flow,0) + COALESCE(ucf.avg_ubike_flow,0)) AS avg_total_flow
+            FROM mrt_case_flow mcf
+            FULL JOIN ubike_case_flow ucf 
+                ON mcf.case_id = ucf.case_id
+               AND mcf.time_period = ucf.time_period
+        ),
+        business_area_info AS (
+            SELECT 
+                ns.case_id,
+                mba.name AS business_area_name,
+                mba.tag AS business_area_tag
+            FROM mrt_nearest_stations ns
+            JOIN src.MRT_Business_Area mba ON ns.mrt_station_id = mba.station_id::VARCHAR
+            GROUP BY ns.case_id, mba.name, mba.tag
+        )
         SELECT 
-            ns.case_id,
-            mba.name AS business_area_name,
-            mba.tag AS business_area_tag
-        FROM mrt_nearest_stations ns
-        JOIN pg.MRT_Business_Area mba ON ns.mrt_station_id = mba.station_id
-        GROUP BY ns.case_id, mba.name, mba.tag
-    )
-    SELECT 
-        cf.case_id,
-        cf.district,
-        cf.village,
-        cf.case_name,
-        bai.business_area_name,
-        cf.time_period,
-        cf.avg_total_flow
-    FROM combined_flow cf
-    LEFT JOIN business_area_info bai ON cf.case_id = bai.case_id
-    {where_clause}
-    ORDER BY cf.district, cf.village, cf.case_name, bai.business_area_name, cf.time_period ASC;
-    """)
-    json = res.df().to_dict(orient='records')
+            cf.case_id,
+            cf.district,
+            cf.village,
+            cf.case_name,
+            bai.business_area_name,
+            cf.time_period,
+            cf.avg_total_flow
+        FROM combined_flow cf
+        LEFT JOIN business_area_info bai ON cf.case_id = bai.case_id
+        ORDER BY cf.district, cf.village, cf.case_name, bai.business_area_name, cf.time_period ASC;
+        """, {'case_id': case_id})
     return json
 
 @app.get("/village_data")
-def get_village_data(district=None):
-    # 動態構建 WHERE 條件
-    conditions = []
-    if district:
-        conditions.append(f"vi.district = '{district}'")
-    
-    # 合成 WHERE 子句
-    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-    res = con.sql(f"""--sql
-        SELECT vi.district, vi.village, vi.household_count, vi.avg_income,
-        ROUND(AVG(vi.avg_income) OVER (PARTITION BY vi.district)) AS nearby_avg_income, vi.median_income,
-        ROUND(AVG(vi.household_count) OVER (PARTITION BY vi.district)) AS nearby_avg_density,
-        ROUND(vi.male_population * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.village), 4) AS male_population_ratio, 
-        ROUND(vi.female_population * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.village), 4) AS female_population_ratio, 
-        ROUND(v.age_0_9 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.village), 4) AS avg_0_9_ratio, 
-        ROUND(v.age_10_19 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.village), 4) AS avg_10_19_ratio, 
-        ROUND(v.age_20_29 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.village), 4) AS avg_20_29_ratio, 
-        ROUND(v.age_30_64 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.village), 4) AS avg_30_64_ratio, 
-        ROUND(v.age_over_65 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.village), 4) AS avg_over_65_ratio,
-        ROUND(v.age_0_9 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_0_9_ratio, 
-        ROUND(v.age_10_19 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_10_19_ratio, 
-        ROUND(v.age_20_29 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_20_29_ratio, 
-        ROUND(v.age_30_64 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_30_64_ratio, 
-        ROUND(v.age_over_65 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_over_65_ratio 
-        FROM pg.Village_Info vi
-        LEFT JOIN pg.Village_Population_By_Age v ON vi.district = v.district AND vi.village = v.village
-        {where_clause}
-    """)
-    json = res.df().to_dict(orient='records')
+@executors.light()
+@result_cache.cached('village_data', tables=('Village_Info', 'Village_Population_By_Age'))
+def get_village_data(district: District = None, vintage: Optional[int] = None):
+    # 讀取預先算好的村里人口統計，未指定版本時讀目前的版本 (見 /demographic_status)
+    with pool.cursor() as cur:
+        json = queries.records(cur, """--sql
+            SELECT * EXCLUDE (vintage)
+            FROM local.demographic_cube
+            WHERE vintage = COALESCE($vintage, (SELECT vintage FROM local.demographic_vintage WHERE is_current))
+              AND ($district IS NULL OR district = $district)
+            ORDER BY district, village
+        """, {'district': district, 'vintage': vintage})
     return json
 
 @app.get("/competitive_data")
-def get_competitive_data(district=None, village=None, type=None):
-    # 動態構建 WHERE 條件
-    conditions = []
-    if district:
-        conditions.append(f"district = '{district}'")
-    if village:
-        conditions.append(f"village = '{village}'")
-    if type:
-        conditions.append(f"business_type = '{type}'")
-    # 合成 WHERE 子句
-    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-    
-    res = con.sql(f"""--sql
-            SELECT district, village, business_type, business_sub_type, COUNT(business_name) as shop_cnt, ROUND(AVG(capital)) as avg_capital
-            FROM pg.Business_Operation
-            {where_clause}
-            GROUP BY district, village, business_type, business_sub_type
-          """)
-    json = res.df().to_dict(orient='records')
+@executors.light()
+@result_cache.cached('competitive_data', tables=('Business_Operation',))
+def get_competitive_data(
+    district: District = None,
+    village: Optional[str] = None,
+    type: Optional[str] = None,
+    level: Literal[competition.LEVELS] = 'village',
+):
+    # 讀取預先彙總的 competition_cube；level 為 district 或 city 時回傳行政區或全市的彙總
+    with pool.cursor() as cur:
+        json = queries.records(cur, """--sql
+                SELECT * EXCLUDE (level)
+                FROM local.competition_cube
+                WHERE level = $level
+                  AND ($district IS NULL OR district = $district)
+                  AND ($village IS NULL OR village = $village)
+                  AND ($type IS NULL OR business_type = $type)
+              """, {'district': district, 'village': village, 'type': type, 'level': level})
     return json
 
 @app.get("/top5_subtype_data")
-def get_top5_subtype_data(district=None, village=None):
-    # 動態構建 WHERE 條件
-    conditions = []
-    if district:
-        conditions.append(f"district = '{district}'")
-    if village:
-        conditions.append(f"village = '{village}'")
-
-    # 合成 WHERE 子句
-    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-    
-    res = con.sql(f"""--sql
-            SELECT district, village, business_type, business_sub_type, COUNT(business_name) as shop_cnt, ROUND(AVG(capital)) as avg_capital
-            FROM pg.Business_Operation
-            {where_clause}
-            GROUP BY district, village, business_type, business_sub_type
-            ORDER BY shop_cnt DESC
-            LIMIT 5
-          """)
-    json = res.df().to_dict(orient='records')
+@executors.light()
+@result_cache.cached('top5_subtype_data', tables=('Business_Operation',))
+def get_top5_subtype_data(district: District = None, village: Optional[str] = None):
+    with pool.cursor() as cur:
+        json = queries.records(cur, """--sql
+                SELECT * EXCLUDE (level)
+                FROM local.competition_cube
+                WHERE level = 'village'
+                  AND ($district IS NULL OR district = $district)
+                  AND ($village IS NULL OR village = $village)
+                ORDER BY shop_cnt DESC, business_sub_type
+                LIMIT 5
+              """, {'district': district, 'village': village})
     return json
 
 @app.get("/business_data")
-def get_business_data(business_sub_type=None, district=None, village=None):
-    # 動態構建 WHERE 條件
-    conditions = []
-    if business_sub_type:
-        conditions.append(f"business_sub_type = '{business_sub_type}'")
-    if district:
-        conditions.append(f"district = '{district}'")
-    if village:
-        conditions.append(f"village = '{village}'")
-
-    # 合成 WHERE 子句
-    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-    res = con.sql(f"""--sql
-            SELECT business_name, address, capital, longitude, latitude, district, village
-            FROM pg.Business_Operation 
-            {where_clause}
-          """)
-    json = res.df().to_dict(orient='records')
+@executors.heavy()
+def get_business_data(
+    business_sub_type: Optional[str] = None,
+    district: District = None,
+    village: Optional[str] = None,
+    limit: PageSize = None,
+    cursor: Optional[str] = None,
+    accept: Annotated[Optional[str], Header()] = None,
+):
+    # 依 Accept 回傳 JSON、NDJSON、Arrow 或 Parquet；指定 limit 時依 (店名, 地址, 營業項目) 分頁，三者不保證唯一
+    return formats.respond(pool, """--sql
+            SELECT business_name, address, capital, longitude, latitude, district, village, business_sub_type
+            FROM src.Business_Operation 
+            WHERE ($business_sub_type IS NULL OR business_sub_type = $business_sub_type)
+              AND ($district IS NULL OR district = $district)
+              AND ($village IS NULL OR village = $village)
+          """, {'business_sub_type': business_sub_type, 'district': district, 'village': village}, accept,
+        key=('business_name', 'address', 'business_sub_type'), limit=limit, cursor=cursor, unique=False)
+
+# 各營業項目資本額前 n 名的店家，一次查詢取代逐一營業項目呼叫 /business_data 後再於前端排序
+@app.get("/top_business_data")
+@executors.heavy()
+@result_cache.cached('top_business_data', tables=('Business_Operation',))
+def get_top_business_data(
+    district: District = None,
+    village: Optional[str] = None,
+    business_type: Optional[str] = None,
+    business_sub_type: Annotated[Optional[list[str]], Query()] = None,
+    n: Annotated[int, Query(ge=1, le=100)] = 5,
+):
+    with pool.cursor() as cur:
+        json = queries.records(cur, """--sql
+                SELECT business_sub_type, business_name, address, capital, longitude, latitude, district, village
+                FROM src.Business_Operation
+                WHERE ($business_sub_type IS NULL OR list_contains($business_sub_type, business_sub_type))
+                  AND ($business_type IS NULL OR business_type = $business_type)
+                  AND ($district IS NULL OR district = $district)
+                  AND ($village IS NULL OR village = $village)
+                QUALIFY row_number() OVER (PARTITION BY business_sub_type ORDER BY capital DESC NULLS LAST) <= $n
+                ORDER BY business_sub_type, capital DESC NULLS LAST
+              """, {'business_sub_type': business_sub_type, 'business_type': business_type, 'district': district, 'village': village, 'n': n})
     return json
 
-@app.get("/filtered_shop_rentals")
-def get_filtered_shop_rentals(district=None, min_rent=None, max_rent=None, min_area=None, max_area=None):
-    # 動態構建 WHERE 條件
-    conditions = []
-    if district is not None:
-        conditions.append(f"s.district = '{district}'")
-    if min_rent is not None:
-        conditions.append(f"s.monthly_rent >= {min_rent}")
-    if max_rent is not None:
-        conditions.append(f"s.monthly_rent <= {max_rent}")
-    if min_area is not None:
-        conditions.append(f"s.area_ping >= {min_area}")
-    if max_area is not None:
-        conditions.append(f"s.area_ping <= {max_area}")
-    
-    # 將條件組合成 WHERE 子句
-    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-    
-    # 執行 SQL 查詢
-    query = f"""--sql
+# 座標半徑內的競爭商家：家數、資本額統計與資本額前 k 名，不受村里邊界限制
+@app.get("/competitors_nearby")
+@executors.light()
+def get_competitors_nearby(
+    lat: Annotated[float, Query(ge=-90, le=90)],
+    lon: Annotated[float, Query(ge=-180, le=180)],
+    radius: Annotated[float, Query(gt=0, le=5)] = 0.5,
+    business_type: Optional[str] = None,
+    business_sub_type: Optional[str] = None,
+    k: Annotated[int, Query(ge=0, le=100)] = 5,
+):
+    # radius 單位為公里
+    with pool.cursor() as cur:
+        index = competitors.shop_index(cur)
+    return index.nearby(lat, lon, radius, business_type=business_type, business_sub_type=business_sub_type, k=k)
+
+FILTERED_SHOP_RENTALS = """--sql
     SELECT 
         s.case_id,
         s.district,
@@ -350,137 +380,369 @@ def get_filtered_shop_rentals(district=None, min_rent=None, max_rent=None, min_a
         s.deposit, 
         r.name, 
         r.phone
-    FROM pg.Shop_Rental_Listing s
-    LEFT JOIN pg.Representative r ON s.phone = r.phone
-    
-    {where_clause} -- 動態加入條件
-    """
-    res = con.sql(query)
-    json = res.df().to_dict(orient='records')
+    FROM src.Shop_Rental_Listing s
+    LEFT JOIN src.Representative r ON s.phone = r.phone
+    WHERE ($district IS NULL OR s.district = $district)
+      AND ($min_rent IS NULL OR s.monthly_rent >= $min_rent)
+      AND ($max_rent IS NULL OR s.monthly_rent <= $max_rent)
+      AND ($min_area IS NULL OR s.area_ping >= $min_area)
+      AND ($max_area IS NULL OR s.area_ping <= $max_area)
+"""
+
+@app.get("/filtered_shop_rentals")
+@executors.light()
+def get_filtered_shop_rentals(
+    district: District = None,
+    min_rent: Rent = None,
+    max_rent: Rent = None,
+    min_area: Area = None,
+    max_area: Area = None,
+    limit: PageSize = None,
+    cursor: Optional[str] = None,
+    accept: Annotated[Optional[str], Header()] = None,
+):
+    # 預設的完整 JSON 結果走快取；分頁或其他格式則依 case_id 分頁或串流回傳
+    params = {'district': district, 'min_rent': min_rent, 'max_rent': max_rent, 'min_area': min_area, 'max_area': max_area}
+    if limit is None and cursor is None and formats.negotiate(accept) == formats.JSON:
+        return filtered_shop_rentals(**params)
+    return formats.respond(pool, FILTERED_SHOP_RENTALS, params, accept, key=('case_id',), limit=limit, cursor=cursor)
+
+@result_cache.cached('filtered_shop_rentals', tables=('Shop_Rental_Listing', 'Representative'))
+def filtered_shop_rentals(district=None, min_rent=None, max_rent=None, min_area=None, max_area=None):
+    with pool.cursor() as cur:
+        json = queries.records(cur, FILTERED_SHOP_RENTALS, {
+            'district': district, 'min_rent': min_rent, 'max_rent': max_rent, 'min_area': min_area, 'max_area': max_area,
+        })
     return json
 
-@app.get("/organization_flow_data")
-def get_organization_flow_data(rank=None, tag=None):
-    filter_condition = f'qualify rank >= {rank}' if rank else ''
-    res = con.sql(f"""--sql
-        with business_area_info as (
-            select
-                distinct name, tag, description
-            from pg.MRT_Business_Area
-        ),
-        MRT_UBIKES as (
-            select mrt_id, array_agg(distinct ubike_id) as UBIKEs
-            from (
-                select
-                    a.station_id as mrt_id,
-                    b.station_id as ubike_id,
-                    6371 * ACOS(
-                        COS(RADIANS(a.latitude)) * COS(RADIANS(b.latitude)) *
-                        COS(RADIANS(b.longitude) - RADIANS(a.longitude)) +
-                        SIN(RADIANS(a.latitude)) * SIN(RADIANS(b.latitude))
-                    ) AS distance_km
-                from pg.MRT_Station_Info as a
-                cross join pg.Ubike_Station_Info as b
-                where distance_km <= 1
+# 依評分模型排序候選店面：條件與 /filtered_shop_rentals 相同，一次回傳前 n 名與各項分數
+@app.get("/recommended_listings")
+@executors.heavy()
+@result_cache.cached('recommended_listings', tables=(
+    'Shop_Rental_Listing', 'Representative', 'MRT_Station_Info', 'Ubike_Station_Info', 'MRT_Flow_Record',
+    'Ubike_Station_Rental_Record', 'Village_Info', 'Village_Population_By_Age', 'Business_Operation',
+))
+def get_recommended_listings(
+    district: District = None,
+    min_rent: Rent = None,
+    max_rent: Rent = None,
+    min_area: Area = None,
+    max_area: Area = None,
+    business_type: Optional[str] = None,
+    radius: Annotated[float, Query(gt=0, le=5)] = 0.5,
+    n: Annotated[int, Query(ge=1, le=100)] = 10,
+    w_rent: Annotated[float, Query(ge=0, le=10)] = 1,
+    w_flow: Annotated[float, Query(ge=0, le=10)] = 1,
+    w_income: Annotated[float, Query(ge=0, le=10)] = 1,
+    w_competition: Annotated[float, Query(ge=0, le=10)] = 1,
+):
+    # radius (公里) 為計算同業家數的範圍；人潮取 1 公里內最近的捷運站與 Ubike 站
+    with pool.cursor() as cur:
+        features = cur.execute(f"""--sql
+            WITH candidates AS ({FILTERED_SHOP_RENTALS}),
+            station_flow AS (
+                SELECT 'mrt' AS station_kind, station_id, avg(flow_sum) AS avg_daily_flow FROM local.mrt_flow_daily GROUP BY ALL
+                UNION ALL
+                SELECT 'ubike', station_id, avg(flow_sum) FROM local.ubike_flow_daily GROUP BY ALL
+            ),
+            listing_flow AS (
+                SELECT n.case_id, SUM(f.avg_daily_flow) AS daily_flow
+                FROM local.listing_nearest_station n
+                JOIN station_flow f USING (station_kind, station_id)
+                WHERE n.rank = 1 AND n.distance_km <= $nearby_radius
+                  AND n.case_id IN (SELECT case_id FROM candidates)
+                GROUP BY n.case_id
             )
-            group by all
-        ),
-        MRT_avg_daily_cnt as (
-            select station_id, avg(total_cnt) as avg_daily_cnt
-            from (
-                select
-                    station_id, date, sum(entrance_count+exit_count) as total_cnt
-                from pg.MRT_Flow_Record
-                group by all
+            SELECT
+                c.case_id, c.district, c.village, c.case_name, c.address, c.monthly_rent, c.area_ping,
+                c.name, c.phone, l.latitude, l.longitude,
+                c.monthly_rent_per_ping, ROUND(COALESCE(lf.daily_flow, 0)) AS daily_flow, d.avg_income
+            FROM candidates c
+            JOIN src.Shop_Rental_Listing l USING (case_id)
+            LEFT JOIN listing_flow lf USING (case_id)
+            LEFT JOIN local.demographic_cube d
+                ON d.district = c.district AND d.village = c.village
+               AND d.vintage = (SELECT vintage FROM local.demographic_vintage WHERE is_current)
+            ORDER BY c.case_id
+        """, {
+            'district': district, 'min_rent': min_rent, 'max_rent': max_rent, 'min_area': min_area, 'max_area': max_area,
+            'nearby_radius': proximity.NEARBY_RADIUS_KM,
+        }).df()
+        if business_type is not None:
+            features['competitor_cnt'] = competitors.shop_index(cur).counts(
+                features['latitude'].to_numpy(), features['longitude'].to_numpy(), radius, business_type=business_type,
             )
-            group by all
-        ),
-        UBIKE_avg_daily_cnt as (
-            select station_id, avg(total_cnt) as avg_daily_cnt
-            from (
-                select
-                    station_id, date, sum(rent_count+return_count) as total_cnt
-                from pg.Ubike_Station_Rental_Record
-                group by all
-            )
-            group by all
-        ),
-        business_area_mrt_avg_daily_cnt as (
-            select
-                name, sum(avg_daily_cnt) as mrt_avg_daily_cnt
-            from pg.MRT_Business_Area as a
-            inner join MRT_avg_daily_cnt as b
-                using (station_id)
-            group by all
-        ),
-        business_area_ubike_avg_daily_cnt as (
-            select
-                name, sum(avg_daily_cnt) as ubike_avg_daily_cnt
-            from (
-                select
-                    name, unnest(UBIKEs) as ubike_station_id
-                from pg.MRT_Business_Area as a
-                inner join MRT_UBIKES as b 
-                    on a.station_id = b.mrt_id
-            ) as a
-            inner join UBIKE_avg_daily_cnt as b
-                on a.ubike_station_id = b.station_id
-            group by all
-        )
-        select
-            name, tag, description, (mrt_avg_daily_cnt+ubike_avg_daily_cnt) as avg_daily_cnt,
-                ntile(10) over (order by avg_daily_cnt) AS rank
-        from business_area_mrt_avg_daily_cnt as a
-        left join business_area_ubike_avg_daily_cnt as b using (name)
-        inner join business_area_info as c using (name)
-        {filter_condition}
-        order by rank
-        """)
-
+    weights = {'rent': w_rent, 'flow': w_flow, 'income': w_income, 'competition': w_competition}
+    return scoring.rank(features, weights, n)
 
-    return res.df().to_dict(orient='records')
-
-    # df = res.df()
-    # return df
+@app.get("/organization_flow_data")
+@executors.light()
+@result_cache.cached('organization_flow_data', tables=('MRT_Station_Info', 'Ubike_Station_Info', 'MRT_Business_Area', 'MRT_Flow_Record', 'Ubike_Station_Rental_Record'))
+def get_organization_flow_data(rank: Rank = None, tag: Optional[str] = None):
+    # 排名於人潮彙總表更新後預先算好 (rollup.refresh_business_area_rank)，更新時間見 /rollup_status
+    with pool.cursor() as cur:
+        json = queries.records(cur, """--sql
+            SELECT name, tag, description, avg_daily_cnt, rank
+            FROM local.business_area_flow_rank
+            WHERE ($rank IS NULL OR rank >= $rank)
+              AND ($tag IS NULL OR tag = $tag)
+            ORDER BY rank
+            """, {'rank': rank, 'tag': tag})
+    return json
 
 @app.get("/business_area_shop_rentals")
-def get_business_area_shop_rentals(business_area=None):
-    filter_condition = f"where name = '{business_area}'" if business_area else ''
-    res = con.sql(f"""--sql
-        with case_id_station_id as (
-            select
-                case_id, (station_id),
-                6371 * ACOS(
-                    COS(RADIANS(a.latitude)) * COS(RADIANS(b.latitude)) *
-                    COS(RADIANS(b.longitude) - RADIANS(a.longitude)) +
-                    SIN(RADIANS(a.latitude)) * SIN(RADIANS(b.latitude))
-                ) AS distance_km
-            from pg.Shop_Rental_Listing as a
-            cross join pg.MRT_Station_Info as b
-            where distance_km <= 1
-        )
-        select distinct name, c.*
-        from pg.MRT_Business_Area as a
-        inner join case_id_station_id as b
-            using (station_id)
-        inner join pg.shop_rental_listing as c
-            on b.case_id = c.case_id
-        {filter_condition}
-        order by all
-        """)
-    business_area_df = res.df()
+@executors.heavy()
+@result_cache.cached('business_area_shop_rentals', tables=('Shop_Rental_Listing', 'MRT_Station_Info', 'MRT_Business_Area'))
+def get_business_area_shop_rentals(business_area: Optional[str] = None):
+    with pool.cursor() as cur:
+        res = cur.execute("""--sql
+            with case_id_station_id as (
+                select case_id, station_id, distance_km
+                from local.listing_nearest_station
+                where station_kind = 'mrt' and rank = 1 and distance_km <= $radius
+            )
+            select distinct name, c.*
+            from src.MRT_Business_Area as a
+            inner join case_id_station_id as b
+                on a.station_id::VARCHAR = b.station_id
+            inner join src.shop_rental_listing as c
+                on b.case_id = c.case_id
+            where $business_area is null or name = $business_area
+            order by all
+            """, {'business_area': business_area, 'radius': proximity.NEARBY_RADIUS_KM})
+        business_area_df = res.df()
     business_area_df = business_area_df.dropna()
     return business_area_df.to_dict(orient='records')
 
+# 店面最近的車站：預設每種車站最近的 1 站；指定 k 取最近 k 站，指定 radius (公里) 則限制在半徑內，
+# 只指定 radius 時回傳半徑內所有車站。未指定 case_id 時查詢所有店面
+@app.get("/nearest_stations")
+@executors.light()
+def get_nearest_stations(
+    case_id: Annotated[Optional[list[int]], Query()] = None,
+    kind: Optional[Literal[tuple(proximity.STATION_TABLES)]] = None,
+    k: Annotated[Optional[int], Query(ge=1, le=20)] = None,
+    radius: Annotated[Optional[float], Query(gt=0, le=5)] = None,
+):
+    if k is None and radius is None:
+        k = 1
+    with pool.cursor() as cur:
+        listings = cur.execute("""--sql
+            SELECT case_id, latitude, longitude
+            FROM src.Shop_Rental_Listing
+            WHERE $case_id IS NULL OR list_contains($case_id, case_id)
+        """, {'case_id': case_id}).df()
+        nearest = proximity.listing_nearest_stations(cur, listings, k, radius, kinds=[kind] if kind else None)
+        cur.register('nearest_stations', nearest)
+        try:
+            json = queries.records(cur, """--sql
+                SELECT n.case_id, n.station_kind, n.station_id, st.station_name, n.distance_km, n.rank
+                FROM nearest_stations n
+                LEFT JOIN (
+                    SELECT 'mrt' AS station_kind, station_id::VARCHAR AS station_id, station_name FROM src.MRT_Station_Info
+                    UNION ALL
+                    SELECT 'ubike', station_id::VARCHAR, station_name FROM src.Ubike_Station_Info
+                ) st USING (station_kind, station_id)
+                ORDER BY n.case_id, n.station_kind, n.rank
+            """)
+        finally:
+            cur.unregister('nearest_stations')
+    return json
+
+@app.get("/listing_analysis")
+@executors.heavy(limit=2)
+@result_cache.cached('listing_analysis', tables=(
+    'Shop_Rental_Listing', 'MRT_Station_Info', 'Ubike_Station_Info', 'MRT_Business_Area', 'MRT_Flow_Record',
+    'Ubike_Station_Rental_Record', 'Village_Info', 'Village_Population_By_Age', 'Business_Operation',
+))
+def get_listing_analysis(case_id: int, business_type: Optional[str] = None):
+    # 分析頁面一次取得單一店面所需的所有資料：人潮光譜、所在村里與同區各村里的人口資料、競爭市場概覽
+    with pool.cursor() as cur:
+        listing = queries.records(cur, """--sql
+            SELECT case_id, district, village, case_name
+            FROM src.Shop_Rental_Listing
+            WHERE case_id = $case_id
+        """, {'case_id': case_id})
+        if not listing:
+            raise HTTPException(status_code=404, detail=f"case_id {case_id} not found")
+        listing = listing[0]
+        district, village = listing['district'], listing['village']
+
+        # 以下沿用各端點的查詢 (與其快取)，確保分析頁與單獨呼叫端點時的結果一致
+        flow = get_shop_flow_data.sync(case_id=case_id)
+        villages = get_village_data.sync(district=district)
+        if business_type:
+            competition = get_competitive_data.sync(district=district, village=village, type=business_type)
+        else:
+            competition = get_top5_subtype_data.sync(district=district, village=village)
+
+    # show_flow_data 每個商圈各一列，人潮值相同，這裡依時段去除重複
+    spectrum = {f['time_period']: f['avg_total_flow'] for f in flow}
+    target = [v for v in villages if v['village'] == village]
+    return {
+        'listing': listing,
+        'business_areas': sorted({f['business_area_name'] for f in flow if f['business_area_name']}),
+        'flow': [{'time_period': t, 'avg_total_flow': spectrum[t]} for t in sorted(spectrum)],
+        'village': target[0] if target else None,
+        'villages': villages,
+        'competition': competition,
+    }
+
 @app.get("/landlord_info")
-def get_landlord_info(phone=None):
-    filter_condition = f"where phone = '{phone}'" if phone else ''
-    res = con.sql(f"from pg.Shop_rental_listing {filter_condition}")
-    landlord_df = res.df()
-    landlord_df = landlord_df.dropna()
-    return landlord_df.to_dict(orient='records')
+@executors.light()
+def get_landlord_info(
+    phone: Optional[str] = None,
+    limit: PageSize = None,
+    cursor: Optional[str] = None,
+    accept: Annotated[Optional[str], Header()] = None,
+):
+    # 欄位有缺值的案件不列出 (原本於 pandas 中 dropna)；指定 limit 時依 case_id 分頁
+    return formats.respond(pool, """--sql
+        FROM src.Shop_rental_listing
+        WHERE ($phone IS NULL OR phone = $phone) AND COLUMNS(*) IS NOT NULL
+    """, {'phone': phone}, accept, key=('case_id',), limit=limit, cursor=cursor)
+
+def update_listings(updates):
+    # 所有修改案件的端點共用：單一交易寫入 pgsql，座標有變動的案件重算鄰近關係，最後淘汰快取
+    # 交易提交後，即使重算失敗或逾時被中斷，快取也一定會被淘汰
+    with pool.cursor() as cur:
+        results, moved = listings.apply_updates(cur, updates)
+        try:
+            proximity.refresh_listings(cur, moved)
+        finally:
+            result_cache.invalidate('Shop_Rental_Listing')
+    return results
 
 @app.put("/update_rental")
-def update_rental(case_id=None, monthly_rent=None):
-    con.sql(f"UPDATE pg.shop_rental_listing SET monthly_rent = {monthly_rent} WHERE case_id = {case_id}")
-    
+@executors.light()
+def update_rental(case_id: int, monthly_rent: Annotated[int, Query(ge=0)]):
+    update_listings([ListingUpdate(case_id=case_id, monthly_rent=monthly_rent)])
+
+# 房東編輯案件，只更新有指定的欄位
+@app.put("/update_listing")
+@executors.light()
+def update_listing(
+    case_id: int,
+    address: Optional[str] = None,
+    area_ping: Area = None,
+    shop_floor: Optional[str] = None,
+    monthly_rent: Rent = None,
+    is_available: Optional[bool] = None,
+):
+    update_listings([ListingUpdate(
+        case_id=case_id, address=address, area_ping=area_ping, shop_floor=shop_floor,
+        monthly_rent=monthly_rent, is_available=is_available,
+    )])
+
+# 批次修改多筆案件，body 為 [{case_id, 欄位...}, ...]，回傳每一筆的結果
+@app.put("/update_listings")
+@executors.light()
+def update_listings_batch(updates: Annotated[list[ListingUpdate], Body(max_length=5000)]):
+    results = update_listings(updates)
+    return {
+        'updated': sum(r['status'] == 'updated' for r in results),
+        'not_found': sum(r['status'] == 'not_found' for r in results),
+        'results': results,
+    }
+
+@app.put("/update_location")
+@executors.light()
+def update_location(
+    case_id: int,
+    longitude: Annotated[float, Query(ge=-180, le=180)],
+    latitude: Annotated[float, Query(ge=-90, le=90)],
+):
+    update_listings([ListingUpdate(case_id=case_id, longitude=longitude, latitude=latitude)])
+
+# 仲介批次上傳案件 (CSV 或 Parquet)，驗證通過的列進入待審核表，回傳未通過的列及原因
+@app.post("/ingest_listings")
+@executors.heavy(limit=2)
+def ingest_listings(file: UploadFile, phone: Annotated[Optional[str], Form()] = None):
+    try:
+        upload = ingest.read_upload(file.file.read(), file.filename or '')
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"cannot read upload: {e}")
+    if upload.num_rows > settings.get('ingest_max_rows', 10000):
+        raise HTTPException(status_code=413, detail=f"at most {settings.get('ingest_max_rows', 10000)} rows per upload")
+    with pool.cursor() as cur:
+        return ingest.stage(cur, upload, phone)
+
+@app.get("/pending_listings")
+@executors.light()
+def get_pending_listings(batch_id: Optional[str] = None):
+    with pool.cursor() as cur:
+        return ingest.pending(cur, batch_id)
+
+# 審核通過：搬到正式的案件表，只為新案件計算與車站的鄰近關係
+@app.put("/approve_listings")
+@executors.heavy(limit=1)
+def approve_listings(batch_id: str, row: Annotated[Optional[list[int]], Query()] = None):
+    with pool.cursor() as cur:
+        case_ids = ingest.approve(cur, batch_id, row)
+        try:
+            proximity.refresh_listings(cur, case_ids)
+        finally:
+            result_cache.invalidate('Shop_Rental_Listing')
+    return {'approved': len(case_ids), 'case_ids': case_ids}
+
+@app.put("/reject_listings")
+@executors.light()
+def reject_listings(batch_id: str, row: Annotated[Optional[list[int]], Query()] = None):
+    with pool.cursor() as cur:
+        return {'rejected': ingest.reject(cur, batch_id, row)}
+
+@app.put("/refresh_rollups")
+@executors.heavy(limit=1, timeout=None)
+def refresh_rollups():
+    # 人潮紀錄匯入後呼叫，只會重算水位所在月份之後的資料
+    with pool.cursor() as cur, db.refresh_lock:
+        rollup.refresh_all(cur)
+        after_rollup_refresh(cur)
+        return queries.to_records(rollup.status(cur))
+
+@app.get("/rollup_status")
+@executors.light()
+def get_rollup_status():
+    with pool.cursor() as cur:
+        return queries.to_records(rollup.status(cur))
+
+@app.get("/demographic_status")
+@executors.light()
+def get_demographic_status():
+    with pool.cursor() as cur:
+        return queries.to_records(demographics.status(cur))
+
+@app.get("/snapshot_status")
+@executors.light()
+def get_snapshot_status():
+    with pool.cursor() as cur:
+        return queries.to_records(snapshot.status(cur))
+
+@app.put("/snapshot_mode")
+@executors.heavy(limit=1, timeout=None)
+def update_snapshot_mode(table: str, mode: str):
+    # mode 為 snapshot 或 live，切換該表的讀取來源
+    with pool.cursor() as cur, db.refresh_lock:
+        try:
+            snapshot.set_mode(cur, table, mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # 讀取來源改變，依賴它的彙總表也一併重建
+        after_snapshot_refresh(cur, [table])
+        return queries.to_records(snapshot.status(cur))
+
+@app.put("/refresh_snapshot")
+@executors.heavy(limit=1, timeout=None)
+def refresh_snapshot():
+    with pool.cursor() as cur, db.refresh_lock:
+        tables = snapshot.refresh(cur)
+        after_snapshot_refresh(cur, tables)
+        return queries.to_records(snapshot.status(cur))
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    return result_cache.stats()
+
+@app.get("/executor_stats")
+async def get_executor_stats():
+    return executors.stats()
@@ -1,12 +1,12 @@
+import io
 import pandas as pd
 import numpy as np
 import streamlit as st
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 #import query as q
-import requests as re
 import random
-from api import con
+import client
 
 
 # 使用者資料儲存
@@ -15,41 +15,86 @@ user_data = {"user_name": None, "phone": None, "email": None}
 # 頁面設定：我是業者 -> 我要租店面
 plt.rcParams['font.family'] = ['Heiti TC']
 
+# Streamlit 每次互動都會重新執行整個頁面，取得的資料與畫好的圖表依請求參數快取，
+# 參數沒變的重新執行不需再呼叫 api 或重畫圖表；房東修改案件後以 invalidate_cache() 清除
+CACHE_TTL_SECONDS = 300
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch(path, params=None):
+    return client.get(path, params)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_frame(path, params=None):
+    return client.get_frame(path, params)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_all(calls):
+    return client.fetch_all(calls)
+
+def invalidate_cache():
+    st.cache_data.clear()
+
+def figure_png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    plt.close(fig)
+    return buf.getvalue()
+
+# 分析頁面所需的資料 (人潮光譜、村里人口、競爭市場) 由 /listing_analysis 一次取得
+# 已選擇營業項目時，競爭店家只依賴店面所在的區與村里，與分析資料同時查詢；否則需等分析結果中的前五大營業項目
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_listing_analysis(case_id, district, village, business_type=None):
+    analysis_params = {'case_id': case_id, 'business_type': business_type}
+    top_params = {'district': district, 'village': village, 'n': 5}
+    if business_type:
+        results = client.fetch_all({
+            'analysis': ('/listing_analysis', analysis_params),
+            'top_stores': ('/top_business_data', dict(top_params, business_type=business_type)),
+        })
+        analysis, top_stores = results['analysis'], results['top_stores']
+    else:
+        analysis = client.get('/listing_analysis', analysis_params)
+        subtypes = [row['business_sub_type'] for row in analysis['competition']]
+        top_stores = client.get('/top_business_data', dict(top_params, business_sub_type=subtypes)) if subtypes else []
+    return analysis, top_stores
+
 # 每日平均人潮流動折線圖
-def crowd_flow_spectrum(case_id):
-    #df = q.get_shop_flow_data(case_id=case_id)
-    data = re.get(url=f'http://127.0.0.1:8000/show_flow_data?case_id={case_id}').json()
-    df = pd.DataFrame(data)
+def crowd_flow_spectrum(analysis):
+    df = pd.DataFrame(analysis['flow'])
     if 'time_period' not in df.columns or 'avg_total_flow' not in df.columns:
         st.error("Required columns not found in the data.")
         return
-    
+    st.image(crowd_flow_png(analysis['listing']['case_id'], df))
+
+# 以底線開頭的參數不列入快取的 key，圖表只依 case_id 快取
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def crowd_flow_png(case_id, _df):
     # data for plotting
+    df = _df.copy()
     df['time_period'] = pd.Categorical(df['time_period'], ordered=True)
     df.sort_values('time_period', inplace=True)  # 按 time_period 排序
     df.reset_index(drop=True, inplace=True)
     
-    plt.figure(figsize=(10, 6))
-    plt.plot(df['time_period'], df['avg_total_flow'], marker='o', linestyle='-', color='tab:blue')
-    plt.xlabel('時刻(時)')
-    plt.ylabel('平均流動人潮')
-    plt.grid(True)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(df['time_period'], df['avg_total_flow'], marker='o', linestyle='-', color='tab:blue')
+    ax.set_xlabel('時刻(時)')
+    ax.set_ylabel('平均流動人潮')
+    ax.grid(True)
 
-    plt.xticks(rotation=45)
-    st.pyplot(plt)
+    ax.tick_params(axis='x', labelrotation=45)
+    return figure_png(fig)
 
 # 住戶密度 & 收入水平分析
-def income_density_chart(case_id, district):
-    # 查詢該 case_id 所在 village 的資訊
-    #shop_flow_df = q.get_shop_flow_data(case_id=case_id)
-    data = re.get(url=f'http://127.0.0.1:8000/show_flow_data?case_id={case_id}').json()
-    shop_flow_df = pd.DataFrame(data)
-    target_village = shop_flow_df['village'].iloc[0]
-    
-    # 查詢該區域所有 village 的資訊
-    #village_df = q.get_village_data(district=district)
-    data = re.get(url=f'http://127.0.0.1:8000/village_data?district={district}').json()
-    village_df = pd.DataFrame(data)
+def income_density_chart(analysis):
+    st.image(income_density_png(analysis['listing']['case_id'], analysis))
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def income_density_png(case_id, _analysis):
+    analysis = _analysis
+    # 該 case_id 所在 village 與同區域所有 village 的資訊
+    district = analysis['listing']['district']
+    target_village = analysis['listing']['village']
+    village_df = pd.DataFrame(analysis['villages'])
     
     # 篩出目標 village 的數據
     target_data = village_df[village_df['village'] == target_village]
@@ -81,39 +126,29 @@ def income_density_chart(case_id, district):
     ax.set_ylabel("收入水平")
     ax.legend()
     
-    st.pyplot(fig)
+    return figure_png(fig)
 
 # 年齡層分析
-def age_distribution_page(case_id, district):
-    # 流動人潮
-    #shop_flow_df = q.get_shop_flow_data(case_id=case_id)
-    data = re.get(url=f'http://127.0.0.1:8000/show_flow_data?case_id={case_id}').json()
-    shop_flow_df = pd.DataFrame(data)
-    target_village = shop_flow_df['village'].iloc[0]
-    
-    # 查詢該區域所有 village 資訊
-    #village_df = q.get_village_data(district=district)
-    data = re.get(url=f'http://127.0.0.1:8000/village_data?district={district}').json()
-    village_df = pd.DataFrame(data)
-    # 篩出目標 village 數據
-    target_data = village_df[village_df['village'] == target_village]
+def age_distribution_page(analysis):
+    # 目標 village 數據
+    target_data = analysis['village']
     
     # 計算年齡分布比例
     age_distribution = {
-        "孩童": target_data['avg_0_9_ratio'].iloc[0] * 100,
-        "青少年": target_data['avg_10_19_ratio'].iloc[0] * 100,
-        "新鮮人": target_data['avg_20_29_ratio'].iloc[0] * 100,
-        "壯年": target_data['avg_30_64_ratio'].iloc[0] * 100,
-        "老年": target_data['avg_over_65_ratio'].iloc[0] * 100,
+        "孩童": target_data['avg_0_9_ratio'] * 100,
+        "青少年": target_data['avg_10_19_ratio'] * 100,
+        "新鮮人": target_data['avg_20_29_ratio'] * 100,
+        "壯年": target_data['avg_30_64_ratio'] * 100,
+        "老年": target_data['avg_over_65_ratio'] * 100,
     }
     
     # 比較目標村里和周邊地區的年齡分布
     age_comparison = {
-        "孩童": compare_ratios(target_data['avg_0_9_ratio'].iloc[0], target_data['nearby_0_9_ratio'].iloc[0]),
-        "青少年": compare_ratios(target_data['avg_10_19_ratio'].iloc[0], target_data['nearby_10_19_ratio'].iloc[0]),
-        "新鮮人": compare_ratios(target_data['avg_20_29_ratio'].iloc[0], target_data['nearby_20_29_ratio'].iloc[0]),
-        "壯年": compare_ratios(target_data['avg_30_64_ratio'].iloc[0], target_data['nearby_30_64_ratio'].iloc[0]),
-        "老年": compare_ratios(target_data['avg_over_65_ratio'].iloc[0], target_data['nearby_over_65_ratio'].iloc[0]),
+        "孩童": compare_ratios(target_data['avg_0_9_ratio'], target_data['nearby_0_9_ratio']),
+        "青少年": compare_ratios(target_data['avg_10_19_ratio'], target_data['nearby_10_19_ratio']),
+        "新鮮人": compare_ratios(target_data['avg_20_29_ratio'], target_data['nearby_20_29_ratio']),
+        "壯年": compare_ratios(target_data['avg_30_64_ratio'], target_data['nearby_30_64_ratio']),
+        "老年": compare_ratios(target_data['avg_over_65_ratio'], target_data['nearby_over_65_ratio']),
     }
     
     age_groups = ["孩童", "青少年", "新鮮人", "壯年", "老年"]
@@ -149,71 +184,54 @@ def compare_ratios(target_ratio, nearby_ratio):
         return "客群量低於附近其他地區"
 
 # 性別比例
-def gender_distribution_page(case_id, district):
-    #shop_flow_df = q.get_shop_flow_data(case_id=case_id)
-    data = re.get(url=f'http://127.0.0.1:8000/show_flow_data?case_id={case_id}').json()
-    shop_flow_df = pd.DataFrame(data)
-    target_village = shop_flow_df['village'].iloc[0]
-    # 查詢該區域所有 village 資訊
-    #village_df = q.get_village_data(district=district)
-    data = re.get(url=f'http://127.0.0.1:8000/village_data?district={district}').json()
-    village_df = pd.DataFrame(data)
-    
-    target_data = village_df[village_df['village'] == target_village]
-    male = target_data['male_population_ratio'].iloc[0]*100
-    female = target_data['female_population_ratio'].iloc[0]*100
+def gender_distribution_page(analysis):
+    st.image(gender_distribution_png(analysis['listing']['case_id'], analysis['village']))
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def gender_distribution_png(case_id, _target_data):
+    target_data = _target_data
+    male = target_data['male_population_ratio']*100
+    female = target_data['female_population_ratio']*100
     gender_distribution = {"男": male, "女": female}
     colors = ['#66b3ff', '#ff66b3']
 
     fig, ax = plt.subplots()
     ax.pie(gender_distribution.values(), labels=gender_distribution.keys(), autopct='%1.1f%%', startangle=90, colors=colors, wedgeprops={'edgecolor': 'black'})
     ax.axis('equal')
-    st.pyplot(fig)
+    return figure_png(fig)
 
 # 商機分析
-def opportunity_analysis_page():
-    if "selected_rental" in st.session_state:
-        rental = st.session_state.selected_rental
-        case_id = rental["case_id"]
-    if "selected_districts" in st.session_state:
-        selected_districts = st.session_state.selected_districts
-
+def opportunity_analysis_page(analysis):
     # 人潮流量光譜：早到晚
     st.subheader("人潮流量光譜")
-    crowd_flow_spectrum(case_id=case_id)
+    crowd_flow_spectrum(analysis)
+
+    if analysis['village'] is None:
+        st.write("目前沒有該村里的人口資料。")
+        return
 
     # 住戶密度&人潮流動光譜
     st.subheader("住戶密度光譜")
-    income_density_chart(case_id=case_id, district=selected_districts)
+    income_density_chart(analysis)
     
     col1, col2 = st.columns([5, 3])
 
     with col1:
         st.subheader("年齡層分佈")
-        age_distribution_page(case_id=case_id, district=selected_districts)
+        age_distribution_page(analysis)
 
     with col2:
         st.subheader("性別分佈")
-        gender_distribution_page(case_id=case_id, district=selected_districts)
+        gender_distribution_page(analysis)
 
 # 競爭市場
-def competitive_market_page(case_id, district):
+def competitive_market_page(analysis, top_stores):
     # 目標村里
-    #shop_flow_df = q.get_shop_flow_data(case_id=case_id)
-    data = re.get(url=f'http://127.0.0.1:8000/show_flow_data?case_id={case_id}').json()
-    shop_flow_df = pd.DataFrame(data)
-    target_village = shop_flow_df['village'].iloc[0]
+    district = analysis['listing']['district']
+    target_village = analysis['listing']['village']
     
-    # 根據條件選擇查詢方式
-    if "selected_business_type" in st.session_state:
-        selected_type = st.session_state["selected_business_type"]
-        #subtype_df = q.get_competitive_data(district=district, village=target_village, type=selected_type)
-        data = re.get(url=f'http://127.0.0.1:8000/competitive_data?district={district}&village={target_village}&type={selected_type}').json()
-        subtype_df = pd.DataFrame(data)
-    else:
-        #subtype_df = q.get_top5_subtype_data(district=district, village=target_village)
-        data = re.get(url=f'http://127.0.0.1:8000/top5_subtype_data?district={district}&village={target_village}').json()
-        subtype_df = pd.DataFrame(data)
+    # 依是否選擇營業項目，analysis 內為該項目的競爭資料或前五大營業項目
+    subtype_df = pd.DataFrame(analysis['competition'])
     
     # 如果查無資料，顯示提示
     if subtype_df.empty:
@@ -247,14 +265,13 @@ def competitive_market_page(case_id, district):
         col2.write(row["店舖數量"])
         col3.write(row["平均資本額"])
 
+    # 每個營業項目資本額前 5 名的店鋪
+    top_df = pd.DataFrame(top_stores, columns=["business_sub_type", "business_name", "address", "capital", "longitude", "latitude"])
+
     # 顯示每個營業項目的 Top 5 店鋪
     for business in subtype_df["營業項目"]:
         st.write(f"### {business} 的 Top 5 資本額店鋪")
-        #store_df = q.get_business_data(business, district, target_village)
-        data = re.get(url=f'http://127.0.0.1:8000/business_data?business={business}&district={district}&village={target_village}').json()
-        store_df = pd.DataFrame(data)
-        
-        filtered_stores = store_df.nlargest(5, "capital")
+        filtered_stores = top_df[top_df["business_sub_type"] == business]
 
         col1, col2, col3, col4 = st.columns([2, 5, 3, 3])
         col1.markdown("**店名**")
@@ -285,6 +302,8 @@ def rent_store_page():
         st.session_state.trade_area_details = None
     if "rental_details" not in st.session_state:
         st.session_state.rental_details = None
+    if "recommended_details" not in st.session_state:
+        st.session_state.recommended_details = None
 
     # 輸入理想開店地點 - 必填項目
     st.subheader("請至少輸入一個心目中的理想開店地點後，按 “進行查詢”")
@@ -333,17 +352,31 @@ def rent_store_page():
     )
     st.session_state.selected_business_type = business_type
 
-    # 查詢按鈕
+    rental_params = {
+        'district': selected_districts,
+        'min_rent': rent_budget[0],
+        'max_rent': rent_budget[1],
+        'min_area': ping[0],
+        'max_area': ping[1],
+    }
+
+    recommended_params = dict(rental_params, business_type=business_type, n=5)
+
+    # 查詢按鈕：商圈資訊、出租案件與推薦店面彼此獨立，同時查詢
     if st.button("進行查詢"):
-        #organization_data_df = q.get_organization_data(district=selected_districts)
-        data = re.get(url=f'http://127.0.0.1:8000/organization_data?district={selected_districts}').json()
-        organization_data_df = pd.DataFrame(data)
-        st.session_state.trade_area_details = organization_data_df.to_dict(orient='records')
+        results = fetch_all({
+            'trade_areas': ('/organization_data', {'district': selected_districts}),
+            'rentals': ('/filtered_shop_rentals', rental_params),
+            'recommended': ('/recommended_listings', recommended_params),
+        })
+        st.session_state.trade_area_details = results['trade_areas']
         st.session_state.selected_trade_area = None
+        st.session_state.rental_details = (rental_params, results['rentals'])
+        st.session_state.recommended_details = (recommended_params, results['recommended'])
 
     # 分頁: 商圈資訊 和 出租案件
     if st.session_state.trade_area_details:
-        tabs = st.tabs(["商圈資訊", "出租案件"])
+        tabs = st.tabs(["商圈資訊", "出租案件", "推薦店面"])
 
         # Tab 1: 商圈資訊
         with tabs[0]:
@@ -357,12 +390,10 @@ def rent_store_page():
         # Tab 2: 出租案件
         with tabs[1]:
             st.subheader("出租案件")
-            # rentals_df = q.get_filtered_shop_rentals(district=selected_districts,
-            #     min_rent=rent_budget[0], max_rent=rent_budget[1],
-            #     min_area=ping[0], max_area=ping[1]
-            # )
-            # rentals = rentals_df.to_dict(orient='records')
-            rentals = re.get(url=f"http://127.0.0.1:8000/filtered_shop_rentals?district={selected_districts}&min_rent={rent_budget[0]}&max_rent={rent_budget[1]}&min_area={ping[0]}&max_area={ping[1]}").json()
+            # 查詢後若調整了條件，重新取得出租案件
+            if st.session_state.rental_details is None or st.session_state.rental_details[0] != rental_params:
+                st.session_state.rental_details = (rental_params, fetch('/filtered_shop_rentals', rental_params))
+            rentals = st.session_state.rental_details[1]
 
             cols = st.columns(2)
             for i, rental in enumerate(rentals):
@@ -388,16 +419,37 @@ def rent_store_page():
                             st.session_state.selected_rental = rental
                             st.session_state.page = "analysis_page"
 
+        # Tab 3: 推薦店面 (依每坪租金、人潮、村里所得與附近同業家數綜合評分)
+        with tabs[2]:
+            st.subheader("推薦店面")
+            if st.session_state.recommended_details is None or st.session_state.recommended_details[0] != recommended_params:
+                st.session_state.recommended_details = (recommended_params, fetch('/recommended_listings', recommended_params))
+            component_names = {'rent': '租金', 'flow': '人潮', 'income': '所得', 'competition': '競爭'}
+            for i, rental in enumerate(st.session_state.recommended_details[1], start=1):
+                with st.expander(f"第 {i} 名 {rental['case_name']} - 總分 {rental['score']:.2f}"):
+                    st.write(f"**地址**: {rental['address']} ({rental['village']})")
+                    st.write(f"**租金**: $ {rental['monthly_rent']}/月 ({int(rental['features']['monthly_rent_per_ping'])}/坪)")
+                    st.write(f"**附近日均人潮**: {int(rental['features']['daily_flow'])}")
+                    cols = st.columns(len(rental['components']))
+                    for col, (name, value) in zip(cols, rental['components'].items()):
+                        col.metric(component_names[name], f"{value:.2f}")
+                    if st.button(f"適不適合我開店", key=f"recommended_check_{rental['case_id']}"):
+                        st.session_state.selected_rental = rental
+                        st.session_state.page = "analysis_page"
+
     # 進行分析
     if st.session_state.get("page", None) == "analysis_page":
         st.session_state.page = None
+        rental = st.session_state.selected_rental
+        analysis, top_stores = fetch_listing_analysis(
+            rental["case_id"], rental["district"], rental["village"],
+            st.session_state.get("selected_business_type"),
+        )
         analysis_tabs = st.tabs(["商機分析", "競爭市場"])
         with analysis_tabs[0]:
-            opportunity_analysis_page()
+            opportunity_analysis_page(analysis)
         with analysis_tabs[1]:
-            if "selected_districts" in st.session_state:
-                selected_districts = st.session_state.selected_districts
-            competitive_market_page(case_id=case_id, district=selected_districts)
+            competitive_market_page(analysis, top_stores)
 
 def find_hotspot_page():
     st.title("📍我要找熱點")
@@ -409,7 +461,7 @@ def find_hotspot_page():
     expected_flow_rank = st.slider("每日平均流動人潮量 ", min_value=0, max_value=10)
 
     # Fetch data
-    data = re.get(url=f'http://127.0.0.1:8000/organization_flow_data?rank={expected_flow_rank}').json()
+    data = fetch('/organization_flow_data', {'rank': expected_flow_rank})
     business_area_df = pd.DataFrame(data)
     st.session_state.business_area = 1
 
@@ -440,7 +492,7 @@ def find_hotspot_page():
 
 def show_rental_info(location):
     st.subheader(f"在 {location} 附近的店面出租資訊")
-    rentals = re.get(url=f'http://127.0.0.1:8000/business_area_shop_rentals?business_area={location}').json()
+    rentals = fetch('/business_area_shop_rentals', {'business_area': location})
 
     # Initialize session state
     if "selected_rental" not in st.session_state:
@@ -468,47 +520,100 @@ def show_rental_info(location):
 # 房東新增出租 case
 def add_case(phone):
     st.subheader("請填寫出租店面的資料：")
-    # required fields
-    st.session_state.case_name = st.text_input("案件名稱")
-    st.session_state.address = st.text_input("地址")
-    st.session_state.district = st.session_state.address[:3]
-    st.session_state.village  = st.session_state.address[3:6]
-    st.session_state.longitude = st.text_input("經度")
-    st.session_state.latitude = st.text_input("緯度")
-    st.session_state.rent = st.text_input("理想租金", placeholder="例如：30000元/月")
-    st.session_state.deposit = st.text_input("押金", placeholder="例如：60000元")
-    st.session_state.area = st.text_input("坪數", placeholder="例如：30坪")
-    st.session_state.shop_floor = st.text_input("店面樓層", placeholder="例如：1樓")
-    st.session_state.total_floor = st.text_input("總樓層", placeholder="例如：5樓")
+    # required fields；各欄位以 add_ 開頭的 key 存放，不與編輯案件的欄位共用
+    st.text_input("案件名稱", key="add_case_name")
+    address = st.text_input("地址", key="add_address")
+    st.session_state.add_district = address[:3]
+    st.session_state.add_village = address[3:6]
+    st.text_input("經度", key="add_longitude")
+    st.text_input("緯度", key="add_latitude")
+    st.text_input("理想租金", placeholder="例如：30000元/月", key="add_rent")
+    st.text_input("押金", placeholder="例如：60000元", key="add_deposit")
+    st.text_input("坪數", placeholder="例如：30坪", key="add_area")
+    st.text_input("店面樓層", placeholder="例如：1樓", key="add_shop_floor")
+    st.text_input("總樓層", placeholder="例如：5樓", key="add_total_floor")
     
 
+# 編輯表單的欄位：(API 參數, 標籤)
+EDIT_FIELDS = {
+    'address': "地址",
+    'area_ping': "坪數 (坪)",
+    'shop_floor': "樓層",
+    'monthly_rent': "理想租金 (元)",
+}
+
 def edit_case(case):
-    st.subheader(f"編輯出租案件：{case['case_id']}")
-        
-    # 使用 st.form 建立輸入表單
-    if 'address' not in st.session_state:
-        st.session_state.address = case['address']
-    if 'size' not in st.session_state:
-        st.session_state.size = case['area_ping']
-    if 'floor' not in st.session_state:
-        st.session_state.floor = case['shop_floor']
-    if 'rent' not in st.session_state:
-        st.session_state.rent = case['monthly_rent']
-
-    st.session_state.address = st.text_input("地址", value=st.session_state.address)
-    st.session_state.size = st.text_input("坪數 (坪)", value=st.session_state.size)
-    st.session_state.floor = st.text_input("樓層", value=st.session_state.floor)
-    rent = st.text_input("理想租金 (元)", value=st.session_state.rent)
+    case_id = case['case_id']
+    st.subheader(f"編輯出租案件：{case_id}")
+
+    # 每個案件的欄位各有自己的 key，預設值取自該案件，切換案件時不會帶入上一個案件輸入的內容
+    original = {field: '' if pd.isna(case[field]) else str(case[field]) for field in EDIT_FIELDS}
+    original['is_available'] = bool(case['is_available'])
+    values = {
+        field: st.text_input(label, value=original[field], key=f"edit_{case_id}_{field}")
+        for field, label in EDIT_FIELDS.items()
+    }
 
     # 狀態選擇
     st.markdown("### 更新狀態")
-    st.session_state.status = st.radio(
+    values['is_available'] = st.radio(
         "目前可供出租:",    
-        (True, False)
+        (True, False),
+        index=0 if original['is_available'] else 1,
+        key=f"edit_{case_id}_is_available",
     )
-    con.sql(f"UPDATE pg.shop_rental_listing SET monthly_rent = {case['monthly_rent']*10} WHERE case_id = {case['case_id']}")
-
-
+    if st.button("送出更新", key=f"submit_{case_id}"):
+        # 只送出有變動的欄位
+        changed = {field: value for field, value in values.items() if value != original[field]}
+        if not changed:
+            st.info("沒有需要更新的欄位")
+            return
+        try:
+            client.put('/update_listing', dict(changed, case_id=case_id))
+        except client.HTTPError as e:
+            st.error(f"更新失敗：{e.response.text}")
+            return
+        # 案件已修改，先前快取的資料與圖表都可能過時
+        invalidate_cache()
+        st.session_state.editing_case = None
+        st.success("案件已更新")
+
+
+
+# 仲介一次上傳多筆案件，驗證通過的案件進入後台審核
+def upload_cases(phone):
+    uploaded = st.file_uploader("批次上傳案件 (CSV / Parquet)", type=['csv', 'parquet'])
+    if uploaded is not None and st.button("上傳", key="upload_cases"):
+        try:
+            result = client.post('/ingest_listings', data={'phone': phone}, files={'file': (uploaded.name, uploaded.getvalue())})
+        except client.HTTPError as e:
+            st.error(f"上傳失敗：{e.response.text}")
+            return
+        st.success(f"已收到 {result['received']} 筆，{result['staged']} 筆送出審核")
+        if result['rejected']:
+            st.warning("以下資料未通過檢查：")
+            st.dataframe(pd.DataFrame(result['rejected']).assign(errors=lambda df: df['errors'].str.join('、')))
+
+# 一次修改多筆案件，只送出有變動的列，由 /update_listings 在同一個交易中寫入
+EDITABLE_COLUMNS = ['case_id', 'case_name', 'address', 'monthly_rent', 'deposit', 'area_ping', 'shop_floor', 'is_available']
+
+def bulk_edit_cases(landlord_cases):
+    original = pd.DataFrame(landlord_cases, columns=EDITABLE_COLUMNS).set_index('case_id')
+    edited = st.data_editor(original, disabled=['case_name'], key='bulk_edit')
+    if st.button("儲存所有變更", key="bulk_submit"):
+        changed = edited[(edited != original).any(axis=1)].drop(columns='case_name')
+        if changed.empty:
+            st.info("沒有需要更新的案件")
+            return
+        try:
+            summary = client.put('/update_listings', json=changed.reset_index().to_dict(orient='records'))
+        except client.HTTPError as e:
+            st.error(f"更新失敗：{e.response.text}")
+            return
+        invalidate_cache()
+        st.success(f"已更新 {summary['updated']} 筆案件")
+        if summary['not_found']:
+            st.warning(f"{summary['not_found']} 筆案件不存在")
 
 # 頁面設定：我是房東
 def landlord_page(phone):
@@ -518,9 +623,12 @@ def landlord_page(phone):
     with st.sidebar:
         if st.button("我要出租店面"):
             add_case(phone)
-    landlord_cases = re.get(url=f"http://127.0.0.1:8000/landlord_info?phone={phone}").json()
+        upload_cases(phone)
+    landlord_cases = fetch_frame('/landlord_info', {'phone': phone}).to_dict(orient='records')
 
     st.subheader("既有出租案件")
+    with st.expander("批次編輯"):
+        bulk_edit_cases(landlord_cases)
     col1, col2 = st.columns(2)
     for idx, case in enumerate(landlord_cases):
         with (col1 if idx % 2 == 0 else col2):
@@ -539,6 +647,11 @@ def landlord_page(phone):
 
             # 編輯/更新按鈕
             if st.button("編輯/更新", key=case['case_id']):
+                # 每次開啟表單時清掉先前輸入的內容，欄位重新以案件目前的值預填
+                for key in [key for key in st.session_state if key.startswith(f"edit_{case['case_id']}_")]:
+                    del st.session_state[key]
+                st.session_state.editing_case = case['case_id']
+            if st.session_state.get('editing_case') == case['case_id']:
                 edit_case(case)
             
             st.divider()
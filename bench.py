@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import requests
+
+
+"""
+量測 api 各端點的單次請求延遲，先以 uvicorn api:app 啟動 server 後執行：
+    python bench.py --case-id 1 --district 大安區
+要比較修改前後，可在兩個版本分別啟動 server 並以相同參數各跑一次
+加上 --planning 則不需啟動 server，直接比較 /filtered_shop_rentals 以 f-string 組 SQL 與參數化查詢的規劃 (EXPLAIN) 時間
+"""
+
+
+def endpoint_cases(args):
+    return {
+        'show_flow_data': ('/show_flow_data', {'case_id': args.case_id}),
+        'organization_data': ('/organization_data', {'district': args.district}),
+        'filtered_shop_rentals': ('/filtered_shop_rentals', {'district': args.district, 'min_rent': 20000, 'max_rent': 60000}),
+        'business_data': ('/business_data', {'district': args.district}),
+        'landlord_info': ('/landlord_info', {}),
+    }
+
+
+def summarize(latencies):
+    latencies.sort()
+    return {
+        'min': latencies[0],
+        'p50': statistics.median(latencies),
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'max': latencies[-1],
+    }
+
+
+def measure(session, url, params, repeat, warmup, headers=None):
+    for _ in range(warmup):
+        session.get(url, params=params, headers=headers).raise_for_status()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = session.get(url, params=params, headers=headers)
+        res.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return summarize(latencies), len(res.content)
+
+
+def filtered_shop_rentals_fstring(select_sql, params):
+    # 參數化之前的寫法：每組參數值產生一段不同的 SQL
+    conditions = []
+    if params['district'] is not None:
+        conditions.append(f"s.district = '{params['district']}'")
+    if params['min_rent'] is not None:
+        conditions.append(f"s.monthly_rent >= {params['min_rent']}")
+    if params['max_rent'] is not None:
+        conditions.append(f"s.monthly_rent <= {params['max_rent']}")
+    if params['min_area'] is not None:
+        conditions.append(f"s.area_ping >= {params['min_area']}")
+    if params['max_area'] is not None:
+        conditions.append(f"s.area_ping <= {params['max_area']}")
+    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return select_sql + where_clause
+
+
+def planning(args):
+    import api
+    import queries
+
+    rng = random.Random(0)
+    cases = [{
+        'district': rng.choice(queries.DISTRICTS + (None,)),
+        'min_rent': rng.randrange(0, 50000, 1000),
+        'max_rent': rng.choice([None, rng.randrange(50000, 200000, 1000)]),
+        'min_area': rng.choice([None, rng.randrange(0, 30)]),
+        'max_area': rng.choice([None, rng.randrange(30, 100)]),
+    } for _ in range(args.repeat)]
+    select_sql = api.FILTERED_SHOP_RENTALS[:api.FILTERED_SHOP_RENTALS.index('WHERE')]
+    variants = {
+        'f-string': lambda cur, p: cur.execute("EXPLAIN " + filtered_shop_rentals_fstring(select_sql, p)),
+        'parameterized': lambda cur, p: cur.execute("EXPLAIN " + api.FILTERED_SHOP_RENTALS, p),
+    }
+
+    async def run():
+        async with api.lifespan(api.app):
+            with api.pool.cursor() as cur:
+                for name, plan in variants.items():
+                    for p in cases[:args.warmup]:
+                        plan(cur, p).fetchall()
+                    latencies = []
+                    for p in cases:
+                        start = time.perf_counter()
+                        plan(cur, p).fetchall()
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    print(f"{name:<24}" + "  ".join(f"{k}={v:8.3f}ms" for k, v in summarize(latencies).items()))
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SmartRent api 延遲量測')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--case-id', default='1')
+    parser.add_argument('--district', default='大安區')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--accept', default=None, help='Accept header，例如 application/vnd.apache.arrow.stream')
+    parser.add_argument('--planning', action='store_true', help='量測 /filtered_shop_rentals 的查詢規劃時間')
+    parser.add_argument('endpoints', nargs='*', help='只量測指定端點，預設全部')
+    args = parser.parse_args()
+    if args.planning:
+        planning(args)
+        return
+
+    session = requests.Session()
+    for name, (path, params) in endpoint_cases(args).items():
+        if args.endpoints and name not in args.endpoints:
+            continue
+        headers = {'Accept': args.accept} if args.accept else None
+        stats, size = measure(session, args.url + path, params, args.repeat, args.warmup, headers)
+        print(f"{name:<24}" + "  ".join(f"{k}={v:8.1f}ms" for k, v in stats.items()) + f"  size={size / 1024:9.1f}KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import functools
+import inspect
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import duckdb
+
+
+"""
+查詢結果快取：以端點名稱加上正規化後的參數作為 key，快取端點回傳的結果
+    - 每筆結果在 ttl_seconds 後過期
+    - 所有結果的估計大小超過 max_bytes 時，從最久沒被使用的開始淘汰 (LRU)
+    - 每筆結果記錄它依賴的資料表，資料表被寫入後以 invalidate(table) 淘汰相關結果
+    - 同一個 key 同時有多個請求未命中時，只有第一個請求執行查詢，其餘等待並共用結果 (single-flight)，
+      避免快取過期或 server 重啟後大量相同查詢同時打到 pgsql
+      執行查詢的請求逾時被中斷 (RETRY_ERRORS) 時，錯誤不會傳給等待中的請求，改由其中一個重新執行
+"""
+
+RETRY_ERRORS = (duckdb.InterruptException,)
+
+
+def _estimate_size(value):
+    # 端點回傳的是 list of dict (部分端點的 dict 中還有巢狀的 list 或 dict)，
+    # 只估算容器與欄位值本身的大小，欄位名稱在各列間共用不重複計算
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        return size + sum(_estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return size + sum(_estimate_size(v) for v in value)
+    return size
+
+
+def make_key(name, kwargs):
+    # 未指定的參數 (None) 不列入 key，其餘一律轉成字串，讓 20000 與 '20000' 對應到同一筆快取
+    params = tuple(sorted((k, str(v).strip()) for k, v in kwargs.items() if v is not None))
+    return (name, params)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    self.coalesced += 1
+            if leader:
+                break
+            call.done.wait()
+            if isinstance(call.error, RETRY_ERRORS):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+
+class QueryCache:
+    def __init__(self, ttl_seconds=300, max_bytes=64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size, expires_at, tables)
+        self._bytes = 0
+        # 每次淘汰資料都會遞增，計算期間若有寫入發生，算出的結果可能已過時，便不放進快取
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return False, None
+            if entry[2] < time.monotonic():
+                self._remove(key)
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return True, entry[0]
+
+    def generation(self):
+        return self._generation
+
+    def put(self, key, value, tables=(), generation=None):
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl_seconds, frozenset(tables))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def invalidate(self, *tables):
+        tables = set(tables)
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, entry in self._entries.items() if entry[3] & tables]
+            for key in stale:
+                self._remove(key)
+            self._counters['invalidations'] += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            count = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self._counters['invalidations'] += count
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._counters,
+                coalesced=self._flights.coalesced,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+            )
+
+    def cached(self, name, tables):
+        # 端點的裝飾器，需放在 @app.get 之下；functools.wraps 保留原本的參數簽名給 FastAPI 解析
+        def decorator(fn):
+            signature = inspect.signature(fn)
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = make_key(name, bound.arguments)
+                found, value = self.get(key)
+                if found:
+                    return value
+
+                def compute():
+                    generation = self.generation()
+                    value = fn(*args, **kwargs)
+                    self.put(key, value, tables, generation)
+                    return value
+                return self._flights.do(key, compute)
+            return wrapper
+        return decorator
@@ -0,0 +1,56 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import requests
+from requests.adapters import HTTPAdapter
+
+
+"""
+Streamlit 前端呼叫 api 的共用 client
+    - 所有請求共用同一個 requests.Session，連線以 keep-alive 重複使用，不需每次重新建立 TCP 連線
+    - api 位址與逾時秒數可用環境變數 SMARTRENT_API_URL、SMARTRENT_API_TIMEOUT 設定
+    - fetch_all() 同時送出一個頁面中彼此獨立的請求，頁面等待時間取決於最慢的請求，而非所有請求的總和
+"""
+
+BASE_URL = os.environ.get('SMARTRENT_API_URL', 'http://127.0.0.1:8000').rstrip('/')
+TIMEOUT = (3.05, float(os.environ.get('SMARTRENT_API_TIMEOUT', 60)))  # (連線, 讀取) 秒數
+MAX_PARALLEL = 8
+ARROW = 'application/vnd.apache.arrow.stream'
+HTTPError = requests.HTTPError
+
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PARALLEL))
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PARALLEL))
+_executor = ThreadPoolExecutor(MAX_PARALLEL, thread_name_prefix='api-client')
+
+
+def get(path, params=None):
+    res = session.get(BASE_URL + path, params=params, timeout=TIMEOUT)
+    res.raise_for_status()
+    return res.json()
+
+
+def get_frame(path, params=None):
+    # 以 Arrow 格式取得資料，直接讀成 DataFrame，不經過 JSON 編碼與解析
+    res = session.get(BASE_URL + path, params=params, headers={'Accept': ARROW}, timeout=TIMEOUT)
+    res.raise_for_status()
+    return pa.ipc.open_stream(res.content).read_pandas()
+
+
+def put(path, params=None, json=None):
+    res = session.put(BASE_URL + path, params=params, json=json, timeout=TIMEOUT)
+    res.raise_for_status()
+    return res.json()
+
+
+def post(path, params=None, data=None, files=None):
+    res = session.post(BASE_URL + path, params=params, data=data, files=files, timeout=TIMEOUT)
+    res.raise_for_status()
+    return res.json()
+
+
+def fetch_all(calls):
+    # calls: {名稱: (path, params)}，同時送出後回傳 {名稱: JSON 結果}
+    futures = {name: _executor.submit(get, path, params) for name, (path, params) in calls.items()}
+    return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,35 @@
+"""
+商家競爭資料的預先彙總表 (cube)：依 (district, village, business_type, business_sub_type) 彙總 Business_Operation，
+並以 GROUPING SETS 一次算出行政區與全市的彙總，/competitive_data 與 /top5_subtype_data 直接查這張表，不需每次掃描整張商家表
+    local.competition_cube (level, district, village, business_type, business_sub_type,
+                            shop_cnt, capital_sum, avg_capital, capital_p25, capital_median, capital_p75)
+level 為 village、district 或 city，彙總到上一層的欄位為 NULL (例如 district 層的 village)
+商家資料隨快照更新，快照更新後呼叫 refresh() 重建
+"""
+
+LEVELS = ('village', 'district', 'city')
+
+
+def refresh(con):
+    con.sql("""--sql
+        CREATE OR REPLACE TABLE local.competition_cube AS
+        SELECT
+            CASE grouping(district, village) WHEN 0 THEN 'village' WHEN 1 THEN 'district' ELSE 'city' END AS level,
+            district,
+            village,
+            business_type,
+            business_sub_type,
+            COUNT(business_name) AS shop_cnt,
+            SUM(capital) AS capital_sum,
+            ROUND(AVG(capital)) AS avg_capital,
+            quantile_cont(capital, 0.25) AS capital_p25,
+            quantile_cont(capital, 0.5) AS capital_median,
+            quantile_cont(capital, 0.75) AS capital_p75
+        FROM src.Business_Operation
+        GROUP BY GROUPING SETS (
+            (district, village, business_type, business_sub_type),
+            (district, business_type, business_sub_type),
+            (business_type, business_sub_type)
+        )
+        ORDER BY level, district, village, shop_cnt DESC
+    """)
@@ -0,0 +1,87 @@
+import threading
+
+import numpy as np
+
+from spatial import GridIndex
+
+
+"""
+以座標查詢半徑內的競爭商家：Business_Operation 的商家座標建成記憶體內的網格空間索引 (spatial.GridIndex)，
+查詢時只取出查詢點周圍網格中的商家計算距離，再以 NumPy 算出家數、資本額統計與資本額前 k 名，
+不受村里邊界限制，查詢時間只與半徑內的商家數有關，可對結果清單中的每個店面逐一呼叫
+索引於第一次查詢時建立，商家資料更新 (快照更新) 後呼叫 reset() 重建
+"""
+
+SHOP_COLUMNS = ['business_name', 'address', 'business_type', 'business_sub_type', 'capital', 'longitude', 'latitude', 'district', 'village']
+CELL_KM = 0.5
+_index = None
+_lock = threading.Lock()
+
+
+class ShopIndex:
+    def __init__(self, shops):
+        grid = GridIndex(np.arange(len(shops)), shops['latitude'].to_numpy(), shops['longitude'].to_numpy(), cell_km=CELL_KM)
+        # 沒有座標的商家不在索引中，商家資料依索引中的順序排列，查詢回傳的位置可直接取值
+        self.grid = grid
+        self.shops = shops.iloc[grid.ids].reset_index(drop=True)
+        # 回傳前 k 名時直接由各欄位的陣列取值，缺值轉成 None
+        self.columns = {column: self.shops[column].astype(object).where(self.shops[column].notna(), None).to_numpy() for column in SHOP_COLUMNS}
+        self.capital = self.shops['capital'].to_numpy(dtype=float, na_value=np.nan)
+        self.business_type = self.shops['business_type'].to_numpy()
+        self.business_sub_type = self.shops['business_sub_type'].to_numpy()
+
+    def counts(self, lats, lons, radius_km, business_type=None, business_sub_type=None):
+        # 批次計算每個座標半徑內的商家數
+        counts = np.zeros(len(lats), dtype=np.int64)
+        for i, (lat, lon) in enumerate(zip(lats, lons)):
+            positions, _ = self.grid.query_radius(lat, lon, radius_km)
+            keep = np.ones(len(positions), dtype=bool)
+            if business_type is not None:
+                keep &= self.business_type[positions] == business_type
+            if business_sub_type is not None:
+                keep &= self.business_sub_type[positions] == business_sub_type
+            counts[i] = keep.sum()
+        return counts
+
+    def nearby(self, lat, lon, radius_km, business_type=None, business_sub_type=None, k=5):
+        positions, distances = self.grid.query_radius(lat, lon, radius_km)
+        keep = np.ones(len(positions), dtype=bool)
+        if business_type is not None:
+            keep &= self.business_type[positions] == business_type
+        if business_sub_type is not None:
+            keep &= self.business_sub_type[positions] == business_sub_type
+        positions, distances = positions[keep], distances[keep]
+
+        capital = self.capital[positions]
+        known = capital[~np.isnan(capital)]
+        # 資本額由高到低取前 k 名，資本額缺值的排在最後
+        order = np.lexsort((distances, np.isnan(capital), -np.nan_to_num(capital, nan=0.0)))[:k]
+        top = [
+            dict({column: values[position] for column, values in self.columns.items()}, distance_km=round(float(distance), 4))
+            for position, distance in zip(positions[order], distances[order])
+        ]
+        return {
+            'shop_cnt': len(positions),
+            'capital_sum': float(known.sum()) if len(known) else None,
+            'avg_capital': float(np.round(known.mean())) if len(known) else None,
+            'capital_p25': float(np.quantile(known, 0.25)) if len(known) else None,
+            'capital_median': float(np.quantile(known, 0.5)) if len(known) else None,
+            'capital_p75': float(np.quantile(known, 0.75)) if len(known) else None,
+            'top': top,
+        }
+
+
+def shop_index(con):
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                shops = con.sql(f"SELECT {', '.join(SHOP_COLUMNS)} FROM src.Business_Operation").df()
+                _index = ShopIndex(shops)
+    return _index
+
+
+def reset():
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,120 @@
+import duckdb
+import threading
+from contextlib import contextmanager
+
+
+"""
+duckdb 連線池：所有執行緒共用同一個 duckdb 資料庫 (含掛載的 pgsql)，但每個執行緒使用自己的 cursor，
+FastAPI 以 threadpool 執行同步的端點時，不同請求的查詢才能真正平行執行
+同時執行的查詢數量以 pool_size 限制，pgsql 端的連線數則以 pg_connection_limit 限制，
+兩者都可以在 connection_setting.json 中設定，以配合 pgsql 的 max_connections
+串流回應佔用 cursor 的時間取決於 client 讀取的速度，因此另有 stream_limit 個名額，不佔用 pool_size 的名額，
+名額用完時不等待，直接拋出 PoolExhausted
+資料庫在第一次取用時才連線 (通常是 server 啟動的 lifespan)，import 這個模組本身不會連線或載入套件
+postgres 套件放在 extension_directory (預設 .duckdb_extensions)，已安裝時直接載入，不需連網，
+部署前可先執行 python db.py 將套件下載到該目錄
+本地 duckdb 中的衍生表 (快照、人潮彙總表、排名、cube、鄰近關係) 以各自的交易整批重建，
+兩個更新同時進行會在提交時衝突 (Conflict on tuple deletion)，因此所有更新路徑 (啟動、排程、端點) 共用 refresh_lock
+"""
+
+EXTENSIONS = ['postgres']
+refresh_lock = threading.RLock()
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def load_extensions(con, extension_directory):
+    con.sql(f"SET extension_directory = '{extension_directory}'")
+    for name in EXTENSIONS:
+        try:
+            con.sql(f"LOAD {name}")
+        except duckdb.IOException:
+            # 尚未安裝 (第一次啟動)，下載後再載入
+            con.sql(f"INSTALL {name}")
+            con.sql(f"LOAD {name}")
+
+
+class ConnectionPool:
+    def __init__(self, settings):
+        self.settings = settings
+        self.size = settings.get('pool_size', 8)
+        self._root = None
+        self._init_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._stream_slots = threading.BoundedSemaphore(settings.get('stream_limit', 2))
+        self._local = threading.local()
+
+    @property
+    def root(self):
+        if self._root is None:
+            with self._init_lock:
+                if self._root is None:
+                    self._root = self._connect()
+        return self._root
+
+    def _connect(self):
+        settings = self.settings
+        root = duckdb.connect('')
+        if settings.get('threads'):
+            root.sql(f"SET GLOBAL threads = {int(settings['threads'])}")
+        load_extensions(root, settings.get('extension_directory', '.duckdb_extensions'))
+        root.sql(f"""
+        CREATE or replace SECRET (
+            TYPE POSTGRES,
+            HOST '{settings['host']}',
+            PORT {settings['port']},
+            DATABASE '{settings['database']}',
+            USER '{settings['user']}',
+            PASSWORD '{settings['password']}'
+        );
+        """)
+        root.sql("ATTACH '' AS pg (TYPE POSTGRES);")
+        # postgres extension 內部會為平行掃描開啟多條連線，這裡限制其上限
+        root.sql(f"SET GLOBAL pg_connection_limit = {int(settings.get('pg_connection_limit', self.size))}")
+        return root
+
+    def thread_cursor(self):
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self.root.cursor()
+            self._local.cursor = cursor
+            self._local.depth = 0
+        return cursor
+
+    @contextmanager
+    def cursor(self):
+        cursor = self.thread_cursor()
+        # 同一個執行緒內巢狀取用時沿用已佔用的名額，避免自己等待自己
+        if self._local.depth == 0:
+            self._slots.acquire()
+        self._local.depth += 1
+        try:
+            yield cursor
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                self._slots.release()
+
+    @contextmanager
+    def dedicated_cursor(self):
+        # 串流回應會跨越多次 yield，且每次可能在不同執行緒上繼續，因此不共用執行緒的 cursor，另開一個獨立的 cursor
+        if not self._stream_slots.acquire(blocking=False):
+            raise PoolExhausted(f"all {self.settings.get('stream_limit', 2)} stream slots are in use")
+        cursor = self.root.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            self._stream_slots.release()
+
+
+if __name__ == '__main__':
+    # 預先下載套件到 extension_directory，之後 server 啟動時可離線載入
+    import json
+    with open('connection_setting.json', 'r') as f:
+        settings = json.load(f)
+    con = duckdb.connect('')
+    load_extensions(con, settings.get('extension_directory', '.duckdb_extensions'))
+    print(con.sql("SELECT extension_name, install_path FROM duckdb_extensions() WHERE loaded").fetchall())
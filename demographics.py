@@ -0,0 +1,96 @@
+"""
+村里人口統計的預先計算表：村里資料 (Village_Info、Village_Population_By_Age) 約一年才更新一次，
+各村里的收入、住戶數、性別與年齡比例，以及同區 (district) 的基準值事先算好存進本地 duckdb，
+/village_data 與分析頁直接讀取，不需每次請求都計算十多個 window function
+    local.demographic_cube     (vintage, district, village, ...)  每個版本每個村里一列
+    local.demographic_vintage  (vintage, fingerprint, row_count, built_at, is_current)
+資料版本 (vintage) 以來源兩張表內容的雜湊值 (fingerprint) 辨識：refresh() 時若雜湊值與目前版本相同便不重算，
+不同時新增一個版本並切換為目前版本，舊版本保留 KEEP_VINTAGES 個供比較
+"""
+
+KEEP_VINTAGES = 3
+# 村里的比例以 (district, village) 分組，不同行政區的同名村里不會被加在一起
+CUBE_SQL = """--sql
+    SELECT $vintage AS vintage, vi.district, vi.village, vi.household_count, vi.avg_income,
+    ROUND(AVG(vi.avg_income) OVER (PARTITION BY vi.district)) AS nearby_avg_income, vi.median_income,
+    ROUND(AVG(vi.household_count) OVER (PARTITION BY vi.district)) AS nearby_avg_density,
+    ROUND(vi.male_population * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district, vi.village), 4) AS male_population_ratio,
+    ROUND(vi.female_population * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district, vi.village), 4) AS female_population_ratio,
+    ROUND(v.age_0_9 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district, vi.village), 4) AS avg_0_9_ratio,
+    ROUND(v.age_10_19 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district, vi.village), 4) AS avg_10_19_ratio,
+    ROUND(v.age_20_29 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district, vi.village), 4) AS avg_20_29_ratio,
+    ROUND(v.age_30_64 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district, vi.village), 4) AS avg_30_64_ratio,
+    ROUND(v.age_over_65 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district, vi.village), 4) AS avg_over_65_ratio,
+    ROUND(v.age_0_9 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_0_9_ratio,
+    ROUND(v.age_10_19 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_10_19_ratio,
+    ROUND(v.age_20_29 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_20_29_ratio,
+    ROUND(v.age_30_64 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_30_64_ratio,
+    ROUND(v.age_over_65 * 1.0 / SUM(vi.male_population + vi.female_population) OVER (PARTITION BY vi.district), 4) AS nearby_over_65_ratio
+    FROM src.Village_Info vi
+    LEFT JOIN src.Village_Population_By_Age v ON vi.district = v.district AND vi.village = v.village
+    ORDER BY vi.district, vi.village
+"""
+
+
+def _ensure_tables(con):
+    con.sql("""--sql
+        CREATE TABLE IF NOT EXISTS local.demographic_vintage (
+            vintage INTEGER PRIMARY KEY,
+            fingerprint UBIGINT,
+            row_count BIGINT,
+            built_at TIMESTAMP,
+            is_current BOOLEAN
+        );
+    """)
+
+
+def fingerprint(con):
+    # 兩張來源表所有列的雜湊值合併 (與列的順序無關)
+    return con.sql("""--sql
+        SELECT hash(
+            (SELECT bit_xor(hash(vi)) FROM src.Village_Info vi),
+            (SELECT bit_xor(hash(v)) FROM src.Village_Population_By_Age v),
+            (SELECT count(*) FROM src.Village_Info),
+            (SELECT count(*) FROM src.Village_Population_By_Age)
+        )
+    """).fetchone()[0]
+
+
+def current_vintage(con):
+    _ensure_tables(con)
+    row = con.sql("SELECT vintage FROM local.demographic_vintage WHERE is_current").fetchone()
+    return row[0] if row else None
+
+
+def refresh(con):
+    # 來源資料有變動時才新增版本，回傳目前的版本
+    _ensure_tables(con)
+    digest = fingerprint(con)
+    current = con.sql("SELECT vintage, fingerprint FROM local.demographic_vintage WHERE is_current").fetchone()
+    if current and current[1] == digest:
+        return current[0]
+
+    con.execute("BEGIN")
+    try:
+        vintage = con.sql("SELECT COALESCE(max(vintage), 0) + 1 FROM local.demographic_vintage").fetchone()[0]
+        # 欄位型別沿用來源表，第一次建立時由查詢結果決定
+        con.execute(f"CREATE TABLE IF NOT EXISTS local.demographic_cube AS {CUBE_SQL} LIMIT 0", {'vintage': vintage})
+        con.execute(f"INSERT INTO local.demographic_cube {CUBE_SQL}", {'vintage': vintage})
+        con.execute("UPDATE local.demographic_vintage SET is_current = false WHERE is_current")
+        con.execute("""--sql
+            INSERT INTO local.demographic_vintage
+            SELECT $vintage, $fingerprint, (SELECT count(*) FROM local.demographic_cube WHERE vintage = $vintage), now(), true
+        """, {'vintage': vintage, 'fingerprint': digest})
+        # 只保留最近的幾個版本
+        con.execute("DELETE FROM local.demographic_cube WHERE vintage <= $vintage - $keep", {'vintage': vintage, 'keep': KEEP_VINTAGES})
+        con.execute("DELETE FROM local.demographic_vintage WHERE vintage <= $vintage - $keep", {'vintage': vintage, 'keep': KEEP_VINTAGES})
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return vintage
+
+
+def status(con):
+    _ensure_tables(con)
+    return con.sql("SELECT vintage, fingerprint, row_count, built_at, is_current FROM local.demographic_vintage ORDER BY vintage").df()
@@ -0,0 +1,124 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+
+"""
+端點的執行緒池：端點改為 async，查詢交給專用的執行緒池執行，不再佔用 Starlette 預設的 threadpool
+    heavy  分析型的查詢 (人潮、商圈、村里統計等)
+    light  單純的查詢與寫入 (房東案件、狀態查詢等)
+兩個池各自有固定的執行緒數，慢的分析查詢再多也只會佔滿 heavy，不會讓 light 的端點排隊
+每個端點另可設定同時執行的上限 (limit，超過的請求在 event loop 上等待，不佔執行緒) 與逾時秒數 (timeout)，
+逾時或請求被取消時會中斷該執行緒上正在執行的 duckdb 查詢，並回傳 504
+heavy_workers + light_workers 不應超過 pool_size，否則執行緒會在連線池的名額上互相等待
+"""
+
+DEFAULT = object()
+
+
+class _Call:
+    # 記錄查詢在哪個 cursor 上執行，逾時時由 event loop 呼叫 interrupt() 中斷
+    def __init__(self, pool):
+        self.pool = pool
+        self.cursor = None
+        self._lock = threading.Lock()
+
+    def run(self, fn, args, kwargs):
+        with self._lock:
+            self.cursor = self.pool.thread_cursor()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # 結束後清除，避免中斷到這個執行緒接著執行的其他請求
+            with self._lock:
+                self.cursor = None
+
+    def interrupt(self):
+        with self._lock:
+            if self.cursor is not None:
+                self.cursor.interrupt()
+                return True
+        return False
+
+
+class QueryExecutors:
+    def __init__(self, pool, settings):
+        self.pool = pool
+        self.workers = {
+            'heavy': settings.get('heavy_workers', 4),
+            'light': settings.get('light_workers', 4),
+        }
+        self.executors = {
+            kind: ThreadPoolExecutor(workers, thread_name_prefix=kind) for kind, workers in self.workers.items()
+        }
+        self.timeouts = {
+            'heavy': settings.get('heavy_timeout_seconds', 30),
+            'light': settings.get('light_timeout_seconds', 5),
+        }
+        # connection_setting.json 中可依端點函式名稱覆寫同時執行的上限，例如 {"get_shop_flow_data": 2}
+        self.limits = settings.get('endpoint_limits', {})
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name, counter, delta=1):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'running': 0, 'waiting': 0, 'completed': 0, 'timeouts': 0, 'interrupted': 0})
+            stats[counter] += delta
+
+    def offload(self, kind, limit=None, timeout=DEFAULT):
+        # 端點的裝飾器，需放在 @app.get 之下、@result_cache.cached 之上；timeout=None 表示不設逾時
+        executor = self.executors[kind]
+        if timeout is DEFAULT:
+            timeout = self.timeouts[kind]
+
+        def decorator(fn):
+            name = fn.__name__
+            semaphore = asyncio.Semaphore(self.limits.get(name, limit or self.workers[kind]))
+
+            async def run(call, args, kwargs):
+                self._count(name, 'waiting')
+                async with semaphore:
+                    self._count(name, 'waiting', -1)
+                    self._count(name, 'running')
+                    try:
+                        future = asyncio.get_running_loop().run_in_executor(executor, call.run, fn, args, kwargs)
+                        try:
+                            return await future
+                        except asyncio.CancelledError:
+                            if call.interrupt():
+                                self._count(name, 'interrupted')
+                            raise
+                    finally:
+                        self._count(name, 'running', -1)
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                call = _Call(self.pool)
+                try:
+                    result = await asyncio.wait_for(run(call, args, kwargs), timeout)
+                except asyncio.TimeoutError:
+                    self._count(name, 'timeouts')
+                    raise HTTPException(status_code=504, detail=f"{name} timed out after {timeout}s")
+                self._count(name, 'completed')
+                return result
+            # 其他端點在執行緒內直接呼叫原本的同步函式，不需再經過 event loop
+            wrapper.sync = fn
+            return wrapper
+        return decorator
+
+    def heavy(self, limit=None, timeout=DEFAULT):
+        return self.offload('heavy', limit, timeout)
+
+    def light(self, limit=None, timeout=DEFAULT):
+        return self.offload('light', limit, timeout)
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,163 @@
+import base64
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+
+from db import PoolExhausted
+
+
+"""
+依請求的 Accept header 決定回應格式
+    application/json                     預設，由 duckdb 直接將每列轉成 JSON，不經過 pandas 與 Python dict
+    application/x-ndjson                 每列一行 JSON，邊查詢邊串流回傳
+    application/vnd.apache.arrow.stream  Arrow IPC stream，直接串流 duckdb 結果的 record batches
+    application/vnd.apache.parquet       Parquet 檔案
+client 端以 pyarrow 讀取 Arrow / Parquet 後可直接得到 DataFrame，省去 JSON 的編碼、解析與重建 DataFrame
+
+分頁採 keyset pagination：依端點指定的排序鍵 (例如 case_id) 排序，每頁最多 limit 筆，
+下一頁的 cursor 放在 X-Next-Cursor header，帶上 cursor 即從該鍵之後繼續查詢，不需 OFFSET 掃過前面的資料
+排序鍵不唯一時 (unique=False)，以同一組鍵內各列的順序 (TIEBREAKER) 作為最後一個排序鍵，重複的列不會在換頁時被跳過
+排序鍵可以是 NULL，排序與比較一律將 NULL 視為最大 (NULLS LAST)
+未分頁時 NDJSON 與 Arrow 以串流回傳，記憶體用量只與每批的筆數有關，與結果總筆數無關
+"""
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+ARROW = 'application/vnd.apache.arrow.stream'
+PARQUET = 'application/vnd.apache.parquet'
+ALIASES = {
+    JSON: JSON,
+    NDJSON: NDJSON,
+    ARROW: ARROW,
+    PARQUET: PARQUET,
+    'application/x-parquet': PARQUET,
+}
+STREAM_BATCH_ROWS = 10000
+TIEBREAKER = 'key_row_number'
+
+
+def negotiate(accept):
+    # 依 Accept 中列出的順序取第一個支援的格式，未指定或都不支援時回傳 JSON
+    for part in (accept or '').split(','):
+        media_type = ALIASES.get(part.split(';')[0].strip().lower())
+        if media_type:
+            return media_type
+    return JSON
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, key):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if not isinstance(values, list) or len(values) != len(key):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return values
+
+
+def _page_sql(sql, key, after, unique=True):
+    # (k1, k2) > (v1, v2) 展開成 k1 > v1 OR (k1 = v1 AND k2 > v2)，
+    # 其中 = 為 IS NOT DISTINCT FROM，k > v 在 NULLS LAST 的順序下另包含 k 為 NULL 而 v 不是 NULL 的情況
+    source = f"({sql})"
+    if not unique:
+        # 鍵相同的列依整列的值排序編號，完全相同的列彼此可互換，編號在各頁間一致
+        source = f"(SELECT *, row_number() OVER (PARTITION BY {', '.join(key[:-1])} ORDER BY t) AS {TIEBREAKER} FROM ({sql}) t)"
+    conditions = []
+    for i, column in enumerate(key):
+        equals = [f"{key[j]} IS NOT DISTINCT FROM $after_{j}" for j in range(i)]
+        greater = f"({column} > $after_{i} OR ({column} IS NULL AND $after_{i} IS NOT NULL))"
+        conditions.append("(" + " AND ".join(equals + [greater]) + ")")
+    where_clause = "WHERE " + " OR ".join(conditions) if after is not None else ""
+    return f"""--sql
+        SELECT * FROM {source} page
+        {where_clause}
+        ORDER BY {', '.join(f"{column} NULLS LAST" for column in key)}
+        LIMIT $limit
+    """
+
+
+def _encode(cur, sql, params, media_type):
+    if media_type in (JSON, NDJSON):
+        rows = cur.execute(f"SELECT to_json(t)::VARCHAR FROM ({sql}) t", params).fetchall()
+        if media_type == NDJSON:
+            return ''.join(row + '\n' for (row,) in rows)
+        return '[' + ','.join(row for (row,) in rows) + ']'
+    table = cur.execute(sql, params).fetch_arrow_table()
+    sink = pa.BufferOutputStream()
+    if media_type == ARROW:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pa.parquet.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def _drain(sink):
+    content = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return content
+
+
+def _stream(pool, sql, params, media_type):
+    # 串流期間一直佔用一個獨立的 cursor，client 中斷連線時 generator 被關閉，cursor 隨之釋放
+    # 取得 cursor 後先 yield 一次，由 respond() 在回應開始前執行到這裡，名額已滿時仍可回傳 503
+    with pool.dedicated_cursor() as cur:
+        yield b''
+        if media_type == NDJSON:
+            cur.execute(f"SELECT to_json(t)::VARCHAR FROM ({sql}) t", params)
+            while rows := cur.fetchmany(STREAM_BATCH_ROWS):
+                yield ''.join(row + '\n' for (row,) in rows)
+        else:
+            reader = cur.execute(sql, params).fetch_record_batch(STREAM_BATCH_ROWS)
+            sink = io.BytesIO()
+            with pa.ipc.new_stream(sink, reader.schema) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+                    yield _drain(sink)
+            yield _drain(sink)
+
+
+def respond(pool, sql, params, accept, key=None, limit=None, cursor=None, unique=True):
+    media_type = negotiate(accept)
+    headers = {'Vary': 'Accept'}
+    if limit is None and cursor is None:
+        if media_type in (NDJSON, ARROW):
+            stream = _stream(pool, sql, params, media_type)
+            try:
+                next(stream)
+            except PoolExhausted as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+            return StreamingResponse(stream, media_type=media_type, headers=headers)
+        with pool.cursor() as cur:
+            content = _encode(cur, sql, params, media_type)
+        return Response(content=content, media_type=media_type, headers=headers)
+
+    # 分頁：先取出這一頁 (最多 limit 筆)，再由最後一列的排序鍵產生下一頁的 cursor
+    key = tuple(key) if unique else (*key, TIEBREAKER)
+    after = decode_cursor(cursor, key) if cursor else None
+    page_params = dict(params, limit=limit)
+    for i, value in enumerate(after or []):
+        page_params[f'after_{i}'] = value
+    with pool.cursor() as cur:
+        page = cur.execute(_page_sql(sql, key, after, unique), page_params).fetch_arrow_table()
+        if limit is not None and page.num_rows == limit:
+            last = page.slice(page.num_rows - 1).select(list(key)).to_pylist()[0]
+            headers['X-Next-Cursor'] = encode_cursor([last[column] for column in key])
+        if not unique:
+            page = page.drop_columns([TIEBREAKER])
+        cur.register('page', page)
+        try:
+            content = _encode(cur, "FROM page", {}, media_type)
+        finally:
+            cur.unregister('page')
+    return Response(content=content, media_type=media_type, headers=headers)
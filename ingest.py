@@ -0,0 +1,191 @@
+import io
+import uuid
+
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet
+
+import queries
+
+
+"""
+仲介批次上傳出租案件：CSV 或 Parquet 檔經驗證後放進 pgsql 的待審核表，審核通過後才成為正式案件
+    pg.pending_shop_rental_listing  待審核的案件，以 batch_id (每次上傳一個) 與 row_number (檔案中的第幾列) 識別
+    - 整個檔案以 pyarrow 讀成 Arrow 表，所有驗證在 duckdb 中對整批資料一次完成，不逐列以 Python 檢查
+    - 座標須落在台北市範圍內，且在所填行政區既有商家座標範圍 (外擴 GEO_MARGIN_DEG) 之內，避免經緯度填反或填錯區
+    - 通過驗證的列以單一 INSERT 寫入待審核表，duckdb 的 postgres 套件會以 COPY 批次傳輸，不逐列 INSERT
+    - 審核通過時在同一個交易中搬到 pg.shop_rental_listing 並自待審核表刪除，回傳新案件的 case_id，
+      呼叫端只需為這些 case_id 重算鄰近關係，不需重建整張表
+"""
+
+PENDING_TABLE = 'pg.pending_shop_rental_listing'
+COLUMNS = {
+    'case_name': 'VARCHAR',
+    'district': 'VARCHAR',
+    'village': 'VARCHAR',
+    'address': 'VARCHAR',
+    'monthly_rent': 'INTEGER',
+    'area_ping': 'DOUBLE',
+    'shop_floor': 'VARCHAR',
+    'total_floor': 'VARCHAR',
+    'deposit': 'INTEGER',
+    'phone': 'VARCHAR',
+    'longitude': 'DOUBLE',
+    'latitude': 'DOUBLE',
+}
+NUMERIC = ('monthly_rent', 'area_ping', 'deposit', 'longitude', 'latitude')
+# 台北市的經緯度範圍
+CITY_BOUNDS = {'lat': (24.96, 25.21), 'lon': (121.45, 121.67)}
+GEO_MARGIN_DEG = 0.005  # 約 500 公尺
+
+
+def ensure_table(con):
+    columns = ',\n'.join(f"{column} {column_type}" for column, column_type in COLUMNS.items())
+    con.sql(f"""--sql
+        CREATE TABLE IF NOT EXISTS {PENDING_TABLE} (
+            batch_id VARCHAR,
+            row_number INTEGER,
+            {columns},
+            uploaded_at TIMESTAMP
+        )
+    """)
+
+
+def read_upload(content, filename):
+    # Parquet 保留原本的欄位型別；CSV 一律先讀成字串，型別轉換與格式檢查交給 duckdb
+    if filename.lower().endswith('.parquet'):
+        table = pa.parquet.read_table(io.BytesIO(content))
+    else:
+        convert = pa.csv.ConvertOptions(column_types={column: pa.string() for column in COLUMNS})
+        table = pa.csv.read_csv(io.BytesIO(content), convert_options=convert)
+    # 檔案中缺少的欄位補上空值，多出的欄位忽略
+    for column in COLUMNS:
+        if column not in table.column_names:
+            table = table.append_column(column, pa.nulls(table.num_rows, pa.string()))
+    return table.select(list(COLUMNS))
+
+
+def _validate_sql():
+    casts = ',\n'.join(
+        f"TRY_CAST(NULLIF(trim({column}::VARCHAR), '') AS {column_type}) AS {column}"
+        for column, column_type in COLUMNS.items()
+    )
+    # 與房東新增案件的表單相同，所有欄位皆為必填；phone 可由上傳時指定，套用到檔案中未填的列
+    checks = [
+        f"CASE WHEN NULLIF(trim(original.{column}::VARCHAR), '') IS NULL THEN '{column} 必填' END"
+        for column in COLUMNS if column != 'phone'
+    ]
+    checks.append("CASE WHEN COALESCE(phone, $phone) IS NULL THEN 'phone 必填' END")
+    checks += [
+        f"CASE WHEN NULLIF(trim(original.{column}::VARCHAR), '') IS NOT NULL AND {column} IS NULL THEN '{column} 格式錯誤' END"
+        for column in NUMERIC
+    ]
+    checks += [
+        "CASE WHEN monthly_rent < 0 OR deposit < 0 THEN '租金與押金不可為負' END",
+        "CASE WHEN area_ping <= 0 THEN 'area_ping 須大於 0' END",
+        "CASE WHEN NOT list_contains($districts, district) THEN 'district 不是台北市的行政區' END",
+        "CASE WHEN NOT (latitude BETWEEN $min_lat AND $max_lat AND longitude BETWEEN $min_lon AND $max_lon) THEN '座標不在台北市範圍內' END",
+        """CASE WHEN NOT (latitude BETWEEN e.min_lat - $margin AND e.max_lat + $margin
+                     AND longitude BETWEEN e.min_lon - $margin AND e.max_lon + $margin)
+                THEN '座標不在所填行政區內' END""",
+        "CASE WHEN COALESCE(phone, $phone) NOT IN (SELECT phone FROM src.Representative) THEN 'phone 不是已登記的聯絡人' END",
+        "CASE WHEN address IS NOT NULL AND count(*) OVER (PARTITION BY address) > 1 THEN '檔案中地址重複' END",
+        "CASE WHEN address IN (SELECT address FROM src.Shop_Rental_Listing) THEN '地址已有刊登中的案件' END",
+        f"CASE WHEN address IN (SELECT address FROM {PENDING_TABLE}) THEN '地址已在待審核清單中' END",
+    ]
+    return f"""--sql
+        WITH raw AS (
+            SELECT *, row_number() OVER () AS row_number FROM upload
+        ),
+        typed AS (
+            SELECT row_number, {casts}, raw AS original
+            FROM raw
+        ),
+        district_extent AS (
+            SELECT district, min(latitude) AS min_lat, max(latitude) AS max_lat, min(longitude) AS min_lon, max(longitude) AS max_lon
+            FROM src.Business_Operation
+            GROUP BY district
+        )
+        SELECT
+            typed.* EXCLUDE (original, phone),
+            COALESCE(phone, $phone) AS phone,
+            list_filter([{', '.join(checks)}], x -> x IS NOT NULL) AS errors
+        FROM typed
+        LEFT JOIN district_extent e USING (district)
+        ORDER BY row_number
+    """
+
+
+def stage(con, upload, phone):
+    # 驗證整批上傳的案件，通過的列寫入待審核表；回傳 batch_id、筆數與未通過的列及原因
+    ensure_table(con)
+    batch_id = uuid.uuid4().hex
+    con.register('upload', upload)
+    try:
+        validated = con.execute(_validate_sql(), {
+            'phone': phone,
+            'districts': list(queries.DISTRICTS),
+            'min_lat': CITY_BOUNDS['lat'][0], 'max_lat': CITY_BOUNDS['lat'][1],
+            'min_lon': CITY_BOUNDS['lon'][0], 'max_lon': CITY_BOUNDS['lon'][1],
+            'margin': GEO_MARGIN_DEG,
+        }).fetch_arrow_table()
+    finally:
+        con.unregister('upload')
+
+    con.register('validated', validated)
+    try:
+        con.execute(f"""--sql
+            INSERT INTO {PENDING_TABLE}
+            SELECT $batch_id, row_number, {', '.join(COLUMNS)}, now()
+            FROM validated
+            WHERE len(errors) = 0
+        """, {'batch_id': batch_id})
+        rejected = con.sql("SELECT row_number, errors FROM validated WHERE len(errors) > 0").fetch_arrow_table().to_pylist()
+    finally:
+        con.unregister('validated')
+    return {
+        'batch_id': batch_id,
+        'received': validated.num_rows,
+        'staged': validated.num_rows - len(rejected),
+        'rejected': rejected,
+    }
+
+
+def pending(con, batch_id=None):
+    ensure_table(con)
+    return queries.records(con, f"""--sql
+        FROM {PENDING_TABLE}
+        WHERE $batch_id IS NULL OR batch_id = $batch_id
+        ORDER BY uploaded_at, batch_id, row_number
+    """, {'batch_id': batch_id})
+
+
+def approve(con, batch_id, rows=None):
+    # rows 未指定時核准整批；新案件的 case_id 接在現有最大值之後，回傳這些 case_id
+    ensure_table(con)
+    params = {'batch_id': batch_id, 'rows': rows}
+    selected = "batch_id = $batch_id AND ($rows IS NULL OR list_contains($rows, row_number))"
+    con.execute("BEGIN")
+    try:
+        base = con.sql("SELECT COALESCE(max(case_id), 0) FROM pg.shop_rental_listing").fetchone()[0]
+        count = con.execute(f"SELECT count(*) FROM {PENDING_TABLE} WHERE {selected}", params).fetchone()[0]
+        con.execute(f"""--sql
+            INSERT INTO pg.shop_rental_listing (case_id, {', '.join(COLUMNS)}, is_available)
+            SELECT $base + row_number() OVER (ORDER BY row_number), {', '.join(COLUMNS)}, true
+            FROM {PENDING_TABLE}
+            WHERE {selected}
+        """, dict(params, base=base))
+        con.execute(f"DELETE FROM {PENDING_TABLE} WHERE {selected}", params)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return list(range(base + 1, base + count + 1))
+
+
+def reject(con, batch_id, rows=None):
+    ensure_table(con)
+    return con.execute(f"""--sql
+        DELETE FROM {PENDING_TABLE}
+        WHERE batch_id = $batch_id AND ($rows IS NULL OR list_contains($rows, row_number))
+    """, {'batch_id': batch_id, 'rows': rows}).fetchone()[0]
@@ -0,0 +1,90 @@
+from typing import Optional
+
+import pyarrow as pa
+from pydantic import BaseModel, Field
+
+
+"""
+房東修改出租案件：所有寫入 pg.shop_rental_listing 的更新都經過 apply_updates()
+    - 一次請求可包含多筆 (case_id, 欄位變更)，整批放進一個 Arrow 表，以單一 UPDATE ... FROM 寫入，
+      並包在同一個交易中，不需每筆各自往返 pgsql 與 autocommit；任何一筆寫入失敗則整批 ROLLBACK
+    - 未指定 (None) 的欄位維持原值；同一案件在一批中出現多次時，依序合併，後面的值覆蓋前面的
+    - 回傳每一筆的結果：updated 或 not_found (案件不存在)
+    - 經緯度有變動的案件在交易提交後重算與車站的鄰近關係
+"""
+
+COLUMNS = {
+    'address': pa.string(),
+    'area_ping': pa.float64(),
+    'shop_floor': pa.string(),
+    'total_floor': pa.string(),
+    'monthly_rent': pa.int64(),
+    'deposit': pa.int64(),
+    'longitude': pa.float64(),
+    'latitude': pa.float64(),
+    'is_available': pa.bool_(),
+}
+LOCATION_COLUMNS = ('longitude', 'latitude')
+
+
+class ListingUpdate(BaseModel):
+    case_id: int
+    address: Optional[str] = None
+    area_ping: Optional[float] = Field(None, ge=0)
+    shop_floor: Optional[str] = None
+    total_floor: Optional[str] = None
+    monthly_rent: Optional[int] = Field(None, ge=0)
+    deposit: Optional[int] = Field(None, ge=0)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    is_available: Optional[bool] = None
+
+
+def _merge(updates):
+    merged = {}
+    for update in updates:
+        fields = update.model_dump(exclude_none=True)
+        merged.setdefault(fields.pop('case_id'), {}).update(fields)
+    return merged
+
+
+def apply_updates(cur, updates):
+    # 回傳 (每筆的結果, 經緯度有變動的 case_id)
+    merged = _merge(updates)
+    if not merged:
+        return [], []
+    schema = pa.schema([('case_id', pa.int64())] + list(COLUMNS.items()))
+    table = pa.Table.from_pylist([dict(fields, case_id=case_id) for case_id, fields in merged.items()], schema=schema)
+    assignments = ',\n'.join(f"{column} = COALESCE(u.{column}, t.{column})" for column in COLUMNS)
+
+    cur.register('listing_updates', table)
+    try:
+        cur.execute("BEGIN")
+        try:
+            found = {case_id for (case_id,) in cur.execute("""--sql
+                SELECT case_id FROM pg.shop_rental_listing
+                WHERE case_id IN (SELECT case_id FROM listing_updates)
+            """).fetchall()}
+            if found:
+                cur.execute(f"""--sql
+                    UPDATE pg.shop_rental_listing AS t SET
+                        {assignments}
+                    FROM listing_updates AS u
+                    WHERE t.case_id = u.case_id
+                """)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    finally:
+        cur.unregister('listing_updates')
+
+    results = [
+        {'case_id': update.case_id, 'status': 'updated' if update.case_id in found else 'not_found'}
+        for update in updates
+    ]
+    moved = [
+        case_id for case_id, fields in merged.items()
+        if case_id in found and any(column in fields for column in LOCATION_COLUMNS)
+    ]
+    return results, moved
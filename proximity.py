@@ -0,0 +1,157 @@
+import threading
+
+import pandas as pd
+
+import db
+from spatial import GridIndex
+
+
+"""
+店面與車站的鄰近關係表：啟動時以空間索引一次算出所有 1 公里內的配對並存進本地 duckdb，
+各端點直接 JOIN 這張表；店面新增或座標變動時只重算該店面的配對
+    local.listing_station_proximity (case_id, station_id, station_kind, distance_km)
+    local.mrt_ubike_proximity       (mrt_id, ubike_id, distance_km)
+    local.listing_nearest_station   (case_id, station_kind, station_id, distance_km, rank)  每種車站最近的 NEAREST_K 站，不限距離
+MRT 與 Ubike 的 station_id 型別不一定相同，因此統一存成 VARCHAR
+"""
+
+NEARBY_RADIUS_KM = 1
+NEAREST_K = 3
+STATION_TABLES = {
+    'mrt': 'MRT_Station_Info',
+    'ubike': 'Ubike_Station_Info',
+}
+# 這些表的讀取來源或內容變動後需呼叫 build() 重建
+SOURCE_TABLES = ('Shop_Rental_Listing', *STATION_TABLES.values())
+# 各種車站的空間索引，整組一起建立、一起替換，同一次計算中的各種車站都來自同一組資料
+_station_indexes = None
+_lock = threading.Lock()
+
+
+def _load_station_indexes(con):
+    indexes = {}
+    for kind, table in STATION_TABLES.items():
+        stations = con.sql(f"SELECT station_id, latitude, longitude FROM src.{table}").df()
+        indexes[kind] = GridIndex.from_frame(stations, 'station_id')
+    return indexes
+
+
+def station_indexes(con):
+    global _station_indexes
+    indexes = _station_indexes
+    if indexes is None:
+        with _lock:
+            if _station_indexes is None:
+                _station_indexes = _load_station_indexes(con)
+            indexes = _station_indexes
+    return indexes
+
+
+def station_index(con, kind):
+    return station_indexes(con)[kind]
+
+
+def listing_station_pairs(con, listings, indexes=None):
+    # listings 需包含 case_id, latitude, longitude 欄位
+    indexes = indexes or station_indexes(con)
+    frames = []
+    for kind in STATION_TABLES:
+        pairs = indexes[kind].pairs_within(
+            listings['case_id'], listings['latitude'], listings['longitude'], NEARBY_RADIUS_KM
+        )
+        pairs['station_kind'] = kind
+        frames.append(pairs)
+    pairs = pd.concat(frames, ignore_index=True)
+    pairs['station_id'] = pairs['station_id'].astype(str)
+    return pairs[['case_id', 'station_id', 'station_kind', 'distance_km']]
+
+
+def listing_nearest_stations(con, listings, k=NEAREST_K, max_km=None, kinds=None, indexes=None):
+    # 每個店面與各種車站中最近的 k 站 (限 max_km 公里內)；listings 需包含 case_id, latitude, longitude 欄位
+    indexes = indexes or station_indexes(con)
+    frames = []
+    for kind in kinds or STATION_TABLES:
+        nearest = indexes[kind].nearest_pairs(
+            listings['case_id'], listings['latitude'], listings['longitude'], k, max_km
+        )
+        nearest['station_kind'] = kind
+        frames.append(nearest)
+    nearest = pd.concat(frames, ignore_index=True)
+    nearest['station_id'] = nearest['station_id'].astype(str)
+    return nearest[['case_id', 'station_kind', 'station_id', 'distance_km', 'rank']]
+
+
+def build(con):
+    # 重新讀取車站位置並重建整張表，車站資料更新後呼叫
+    with db.refresh_lock:
+        _build(con)
+
+
+def _build(con):
+    global _station_indexes
+    # 新的索引先放在區域變數，表重建完成後才整組替換，其他執行緒在這期間仍使用舊的一組
+    indexes = _load_station_indexes(con)
+    listings = con.sql("SELECT case_id, latitude, longitude FROM src.Shop_Rental_Listing").df()
+    pairs = listing_station_pairs(con, listings, indexes)
+    con.sql("""--sql
+        CREATE OR REPLACE TABLE local.listing_station_proximity AS
+        SELECT case_id, station_id, station_kind, distance_km
+        FROM pairs
+        ORDER BY case_id, station_kind, distance_km
+    """)
+    nearest = listing_nearest_stations(con, listings, indexes=indexes)
+    con.sql("""--sql
+        CREATE OR REPLACE TABLE local.listing_nearest_station AS
+        SELECT case_id, station_kind, station_id, distance_km, rank::INTEGER AS rank
+        FROM nearest
+        ORDER BY case_id, station_kind, rank
+    """)
+
+    mrt = indexes['mrt']
+    mrt_ubike_pairs = indexes['ubike'].pairs_within(
+        mrt.ids, mrt.lats, mrt.lons, NEARBY_RADIUS_KM, left_name='mrt_id', right_name='ubike_id'
+    )
+    con.sql("""--sql
+        CREATE OR REPLACE TABLE local.mrt_ubike_proximity AS
+        SELECT mrt_id::VARCHAR AS mrt_id, ubike_id::VARCHAR AS ubike_id, distance_km
+        FROM mrt_ubike_pairs
+        ORDER BY mrt_id, distance_km
+    """)
+    with _lock:
+        _station_indexes = indexes
+
+
+def refresh_listings(con, case_ids):
+    # 僅重算指定店面的配對：新增店面、或店面座標變動後呼叫
+    case_ids = list(case_ids)
+    if not case_ids:
+        return
+    # 與 build() 共用 db.refresh_lock，避免寫到 build() 正在重建的表
+    with db.refresh_lock:
+        _refresh_listings(con, case_ids)
+
+
+def _refresh_listings(con, case_ids):
+    listings = con.execute(
+        "SELECT case_id, latitude, longitude FROM src.Shop_Rental_Listing WHERE list_contains(?, case_id)",
+        [case_ids],
+    ).df()
+    indexes = station_indexes(con)
+    pairs = listing_station_pairs(con, listings, indexes)
+    nearest = listing_nearest_stations(con, listings, indexes=indexes)
+    con.execute("BEGIN")
+    try:
+        con.execute("DELETE FROM local.listing_station_proximity WHERE list_contains(?, case_id)", [case_ids])
+        con.sql("""--sql
+            INSERT INTO local.listing_station_proximity
+            SELECT case_id, station_id, station_kind, distance_km FROM pairs
+        """)
+        con.execute("DELETE FROM local.listing_nearest_station WHERE list_contains(?, case_id)", [case_ids])
+        con.sql("""--sql
+            INSERT INTO local.listing_nearest_station
+            SELECT case_id, station_kind, station_id, distance_km, rank FROM nearest
+        """)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
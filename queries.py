@@ -0,0 +1,32 @@
+from typing import Annotated, Literal, Optional
+
+from fastapi import Query
+
+
+"""
+參數化查詢：各端點的 SQL 都是固定的字串，使用者輸入一律以具名參數 ($district 等) 綁定，不再以 f-string 組出 SQL
+    - 同一個端點不論參數值為何都是同一段 SQL，duckdb 不需針對每組參數值產生不同的語句，也不會有 SQL injection
+    - 選填的條件寫成 ($x IS NULL OR col = $x)，duckdb 綁定參數後會先化簡這些條件，
+      未指定時整個條件消失，有指定時仍會下推到 pgsql 或本地表的掃描，與原本動態組出 WHERE 的查詢計畫相同
+    - 參數在進入查詢前先由 FastAPI 依型別驗證 (數值、行政區列舉)，不合法的輸入直接回傳 422
+"""
+
+DISTRICTS = (
+    "中正區", "大同區", "中山區", "松山區", "大安區", "萬華區", "信義區", "士林區", "北投區",
+    "內湖區", "南港區", "文山區",
+)
+
+District = Optional[Literal[DISTRICTS]]
+Rent = Annotated[Optional[int], Query(ge=0)]
+Area = Annotated[Optional[float], Query(ge=0)]
+Rank = Annotated[Optional[int], Query(ge=0, le=10)]
+PageSize = Annotated[Optional[int], Query(ge=1, le=10000)]
+
+
+def to_records(df):
+    # pandas 將 NULL 轉成 NaN / NaT，無法編碼成 JSON，回傳前一律轉成 None
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+
+def records(cur, sql, params=None):
+    return to_records(cur.execute(sql, params or {}).df())
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+
+import db
+
+
+"""
+捷運與 Ubike 人潮紀錄的彙總表，存放在本地 duckdb (local)，各端點改讀這些彙總表而不需每次掃描兩年份的原始紀錄
+    local.{kind}_flow_hourly (station_id, month, time_period, flow_sum, flow_cnt)  每站、每月、每小時
+    local.{kind}_flow_daily  (station_id, date, flow_sum, flow_cnt)               每站、每日
+同時保存總和與筆數，跨月或跨日合併後仍可算出精確的平均值
+人潮紀錄只會新增，更新時從上次的日期水位 (watermark) 所在月份開始重算，不需重新掃描整段期間
+    local.business_area_flow_rank (name, tag, description, avg_daily_cnt, rank)
+每個商圈的日均人潮 (商圈內捷運站與其 1 公里內 Ubike 站的日均人潮總和) 與 ntile(10) 排名，
+只取決於資料而與請求無關，於每日彙總表更新後重建，/organization_flow_data 直接查這張表
+"""
+
+logger = logging.getLogger(__name__)
+SOURCES = {
+    'mrt': ('MRT_Flow_Record', 'entrance_count + exit_count'),
+    'ubike': ('Ubike_Station_Rental_Record', 'rent_count + return_count'),
+}
+
+
+def _ensure_tables(con):
+    con.sql("""--sql
+        CREATE TABLE IF NOT EXISTS local.rollup_watermark (
+            source VARCHAR PRIMARY KEY,
+            max_date DATE,
+            refreshed_at TIMESTAMP
+        )
+    """)
+    for kind in SOURCES:
+        con.sql(f"""--sql
+            CREATE TABLE IF NOT EXISTS local.{kind}_flow_hourly (
+                station_id VARCHAR, month DATE, time_period INTEGER, flow_sum BIGINT, flow_cnt BIGINT
+            );
+            CREATE TABLE IF NOT EXISTS local.{kind}_flow_daily (
+                station_id VARCHAR, date DATE, flow_sum BIGINT, flow_cnt BIGINT
+            );
+        """)
+
+
+def refresh(con, kind):
+    table, flow = SOURCES[kind]
+    _ensure_tables(con)
+    watermark = con.execute("SELECT max_date FROM local.rollup_watermark WHERE source = ?", [kind]).fetchone()
+    # 從水位所在月份的第一天開始重算，該月先前只彙總到一半的資料也會被完整覆寫
+    if watermark and watermark[0]:
+        start = con.execute("SELECT date_trunc('month', ?::DATE)::DATE", [watermark[0]]).fetchone()[0]
+        date_filter, month_filter, params = "WHERE date >= ?", "WHERE month >= ?", [start]
+    else:
+        date_filter, month_filter, params = "", "", []
+
+    con.execute("BEGIN")
+    try:
+        con.execute(f"DELETE FROM local.{kind}_flow_hourly {month_filter}", params)
+        con.execute(f"DELETE FROM local.{kind}_flow_daily {date_filter}", params)
+        con.execute(f"""--sql
+            INSERT INTO local.{kind}_flow_hourly
+            SELECT station_id::VARCHAR, date_trunc('month', date)::DATE, time_period, SUM({flow}), COUNT(*)
+            FROM src.{table}
+            {date_filter}
+            GROUP BY ALL
+        """, params)
+        con.execute(f"""--sql
+            INSERT INTO local.{kind}_flow_daily
+            SELECT station_id::VARCHAR, date, SUM({flow}), COUNT(*)
+            FROM src.{table}
+            {date_filter}
+            GROUP BY ALL
+        """, params)
+        con.execute(f"""--sql
+            INSERT OR REPLACE INTO local.rollup_watermark
+            SELECT ?, (SELECT max(date) FROM local.{kind}_flow_daily), now()
+        """, [kind])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+
+def refresh_business_area_rank(con):
+    # 依每日彙總表與 local.mrt_ubike_proximity 重建商圈人潮排名，需在兩者更新後呼叫
+    con.execute("BEGIN")
+    try:
+        con.sql("""--sql
+            CREATE OR REPLACE TABLE local.business_area_flow_rank AS
+            with business_area_info as (
+                select
+                    distinct name, tag, description
+                from src.MRT_Business_Area
+            ),
+            MRT_UBIKES as (
+                select mrt_id, array_agg(distinct ubike_id) as UBIKEs
+                from local.mrt_ubike_proximity
+                group by all
+            ),
+            MRT_avg_daily_cnt as (
+                select station_id, avg(flow_sum) as avg_daily_cnt
+                from local.mrt_flow_daily
+                group by all
+            ),
+            UBIKE_avg_daily_cnt as (
+                select station_id, avg(flow_sum) as avg_daily_cnt
+                from local.ubike_flow_daily
+                group by all
+            ),
+            business_area_mrt_avg_daily_cnt as (
+                select
+                    name, sum(avg_daily_cnt) as mrt_avg_daily_cnt
+                from src.MRT_Business_Area as a
+                inner join MRT_avg_daily_cnt as b
+                    on a.station_id::VARCHAR = b.station_id
+                group by all
+            ),
+            business_area_ubike_avg_daily_cnt as (
+                select
+                    name, sum(avg_daily_cnt) as ubike_avg_daily_cnt
+                from (
+                    select
+                        name, unnest(UBIKEs) as ubike_station_id
+                    from src.MRT_Business_Area as a
+                    inner join MRT_UBIKES as b 
+                        on a.station_id::VARCHAR = b.mrt_id
+                ) as a
+                inner join UBIKE_avg_daily_cnt as b
+                    on a.ubike_station_id = b.station_id
+                group by all
+            )
+            select
+                name, tag, description, (mrt_avg_daily_cnt+ubike_avg_daily_cnt) as avg_daily_cnt,
+                    ntile(10) over (order by avg_daily_cnt) AS rank
+            from business_area_mrt_avg_daily_cnt as a
+            left join business_area_ubike_avg_daily_cnt as b using (name)
+            inner join business_area_info as c using (name)
+            order by rank
+        """)
+        con.execute("""--sql
+            INSERT OR REPLACE INTO local.rollup_watermark
+            SELECT 'business_area_rank', (SELECT max(date) FROM local.mrt_flow_daily), now()
+        """)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+
+def refresh_all(con):
+    with db.refresh_lock:
+        for kind in SOURCES:
+            refresh(con, kind)
+        refresh_business_area_rank(con)
+
+
+def status(con):
+    _ensure_tables(con)
+    return con.sql("SELECT source, max_date, refreshed_at FROM local.rollup_watermark ORDER BY source").df()
+
+
+def start_scheduler(pool, interval_minutes, after_refresh=None):
+    # 人潮紀錄直接讀 pgsql (live) 時，定期將新匯入的紀錄併入彙總表並重建排名
+    def loop():
+        while True:
+            time.sleep(interval_minutes * 60)
+            try:
+                with pool.cursor() as cur, db.refresh_lock:
+                    refresh_all(cur)
+                    if after_refresh:
+                        after_refresh(cur)
+            except Exception:
+                logger.exception("rollup refresh failed")
+
+    thread = threading.Thread(target=loop, name='rollup-refresh', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+"""
+店面推薦的評分模型：所有候選店面的特徵放在同一個 DataFrame，以 NumPy 對整欄一次計算分數，不逐一店面呼叫各分析端點
+    rent         每坪租金 (monthly_rent_per_ping)，越低越好
+    flow         最近的捷運站與 Ubike 站日均人潮 (daily_flow)，越多越好
+    income       所在村里的平均所得 (avg_income)，越高越好
+    competition  半徑內同一營業項目的家數 (competitor_cnt)，越少越好，指定 business_type 時才計入
+各項分數為該特徵在候選店面中的百分位 (0 ~ 1)，缺值給 0.5；總分為各項分數依權重的加權平均
+"""
+
+COMPONENTS = {
+    'rent': ('monthly_rent_per_ping', False),
+    'flow': ('daily_flow', True),
+    'income': ('avg_income', True),
+    'competition': ('competitor_cnt', False),
+}
+
+
+def percentile(values, higher_is_better=True):
+    # 相同的值給相同的百分位 (平均名次)，只有一個候選店面或缺值時給 0.5
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    scores = np.full(len(values), 0.5)
+    count = valid.sum()
+    if count > 1:
+        ordered = np.sort(values[valid])
+        below = np.searchsorted(ordered, values[valid], side='left')
+        above = np.searchsorted(ordered, values[valid], side='right')
+        scores[valid] = ((below + above - 1) / 2) / (count - 1)
+    return scores if higher_is_better else 1 - scores
+
+
+def rank(features, weights, n):
+    # features 每列一個候選店面；weights 為 {項目: 權重}，權重為 0 或缺少對應特徵的項目不計分
+    used = {
+        name: weights[name] for name, (column, _) in COMPONENTS.items()
+        if weights.get(name, 0) > 0 and column in features
+    }
+    components = {
+        name: percentile(features[COMPONENTS[name][0]], COMPONENTS[name][1]) for name in used
+    }
+    total = sum(used.values())
+    score = sum(weight * components[name] for name, weight in used.items()) / total if total else np.zeros(len(features))
+
+    top = np.argsort(-score, kind='stable')[:n]
+    columns = [column for column, _ in COMPONENTS.values() if column in features]
+    rows = features.iloc[top].astype(object).where(features.iloc[top].notna(), None).to_dict(orient='records')
+    return [
+        dict(
+            {key: value for key, value in row.items() if key not in columns},
+            score=round(float(score[i]), 4),
+            components={name: round(float(values[i]), 4) for name, values in components.items()},
+            features={column: row[column] for column in columns},
+        )
+        for i, row in zip(top, rows)
+    ]
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+import db
+
+
+"""
+本地快照：將很少變動的 pgsql 資料表複製到本地 duckdb (local.snapshot)，查詢改讀本地副本，省去每次請求的 pgsql 掃描與傳輸
+所有端點一律從 src schema 讀取資料，src 內每張表都是一個 view，依模式指向
+    snapshot: local.snapshot.<table>  本地副本
+    live:     pg.<table>              直接讀 pgsql
+寫入 (例如 /update_rental) 仍直接寫到 pg.<table>，因此 API 會寫入的表 (WRITTEN_TABLES) 只能是 live，
+否則寫入後讀到的仍是舊的本地副本
+"""
+
+logger = logging.getLogger(__name__)
+TABLES = [
+    'Business_Operation',
+    'MRT_Business_Area',
+    'MRT_Flow_Record',
+    'MRT_Station_Info',
+    'Representative',
+    'Shop_Rental_Listing',
+    'Ubike_Station_Info',
+    'Ubike_Station_Rental_Record',
+    'Village_Info',
+    'Village_Population_By_Age',
+]
+WRITTEN_TABLES = ('Shop_Rental_Listing',)
+DEFAULT_SNAPSHOT_TABLES = [t for t in TABLES if t not in WRITTEN_TABLES]
+# 只會新增資料的表，更新時只補上最後一天 (含) 之後的資料
+APPEND_ONLY = {
+    'MRT_Flow_Record': 'date',
+    'Ubike_Station_Rental_Record': 'date',
+}
+
+
+def _ensure_schema(con):
+    con.sql("""--sql
+        CREATE SCHEMA IF NOT EXISTS src;
+        CREATE SCHEMA IF NOT EXISTS local.snapshot;
+        CREATE TABLE IF NOT EXISTS local.snapshot_meta (
+            table_name VARCHAR PRIMARY KEY,
+            mode VARCHAR,
+            row_count BIGINT,
+            refreshed_at TIMESTAMP
+        );
+    """)
+
+
+def _has_copy(con, table):
+    return con.execute("""--sql
+        SELECT count(*) FROM duckdb_tables()
+        WHERE database_name = 'local' AND schema_name = 'snapshot' AND table_name = ?
+    """, [table]).fetchone()[0] > 0
+
+
+def _copy(con, table):
+    date_col = APPEND_ONLY.get(table)
+    start = None
+    if date_col and _has_copy(con, table):
+        start = con.sql(f"SELECT max({date_col}) FROM local.snapshot.{table}").fetchone()[0]
+    if start is not None:
+        con.execute("BEGIN")
+        try:
+            con.execute(f"DELETE FROM local.snapshot.{table} WHERE {date_col} >= ?", [start])
+            con.execute(f"INSERT INTO local.snapshot.{table} SELECT * FROM pg.{table} WHERE {date_col} >= ?", [start])
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+    else:
+        con.sql(f"CREATE OR REPLACE TABLE local.snapshot.{table} AS FROM pg.{table}")
+    row_count = con.sql(f"SELECT count(*) FROM local.snapshot.{table}").fetchone()[0]
+    con.execute("""--sql
+        INSERT OR REPLACE INTO local.snapshot_meta VALUES (?, 'snapshot', ?, now())
+    """, [table, row_count])
+
+
+def _use(con, table, mode):
+    source = f"local.snapshot.{table}" if mode == 'snapshot' else f"pg.{table}"
+    con.sql(f"CREATE OR REPLACE VIEW src.{table} AS FROM {source}")
+    con.execute("""--sql
+        INSERT INTO local.snapshot_meta VALUES (?, ?, NULL, NULL)
+        ON CONFLICT (table_name) DO UPDATE SET mode = excluded.mode
+    """, [table, mode])
+
+
+def _check(table, mode):
+    if table not in TABLES or mode not in ('snapshot', 'live'):
+        raise ValueError(f"unknown table or mode: {table}, {mode}")
+    if mode == 'snapshot' and table in WRITTEN_TABLES:
+        raise ValueError(f"{table} is written through the API and must stay live")
+
+
+def set_mode(con, table, mode):
+    _check(table, mode)
+    _ensure_schema(con)
+    if mode == 'snapshot' and not _has_copy(con, table):
+        _copy(con, table)
+    _use(con, table, mode)
+
+
+def setup(con, snapshot_tables):
+    # server 啟動時呼叫：更新設定為快照模式的表，並建立 src 下的 view
+    for table in snapshot_tables:
+        _check(table, 'snapshot')
+    _ensure_schema(con)
+    for table in TABLES:
+        mode = 'snapshot' if table in snapshot_tables else 'live'
+        if mode == 'snapshot':
+            _copy(con, table)
+        _use(con, table, mode)
+
+
+def refresh(con):
+    # 回傳更新了哪些表
+    _ensure_schema(con)
+    tables = [table for (table,) in con.sql("SELECT table_name FROM local.snapshot_meta WHERE mode = 'snapshot' ORDER BY table_name").fetchall()]
+    for table in tables:
+        _copy(con, table)
+    return tables
+
+
+def status(con):
+    _ensure_schema(con)
+    return con.sql("""--sql
+        SELECT
+            table_name,
+            mode,
+            row_count,
+            refreshed_at,
+            CASE WHEN mode = 'snapshot' THEN epoch(now()::TIMESTAMP - refreshed_at) END AS age_seconds
+        FROM local.snapshot_meta
+        ORDER BY table_name
+    """).df()
+
+
+def start_scheduler(pool, interval_minutes, after_refresh=None):
+    # 背景執行緒定期更新快照，after_refresh(cur, tables) 可用來接著更新依賴這些表的彙總表
+    def loop():
+        while True:
+            time.sleep(interval_minutes * 60)
+            try:
+                with pool.cursor() as cur, db.refresh_lock:
+                    tables = refresh(cur)
+                    if after_refresh:
+                        after_refresh(cur, tables)
+            except Exception:
+                logger.exception("snapshot refresh failed")
+
+    thread = threading.Thread(target=loop, name='snapshot-refresh', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+
+"""
+空間索引：將經緯度切成固定大小的網格 (grid cell)，查詢「半徑 r 公里內」的點時
+只需取出查詢點周圍幾個網格內的候選點，先以 bounding box 過濾，再計算精確的球面距離，
+取代原本 listings x stations 的 CROSS JOIN 全表距離計算
+"""
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEG_LAT = np.pi * EARTH_RADIUS_KM / 180
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # 與原本 SQL 中的 ACOS 球面餘弦公式相同，clip 避免浮點誤差造成 ACOS 超出定義域
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    cos_angle = (
+        np.cos(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+        + np.sin(lat1) * np.sin(lat2)
+    )
+    return EARTH_RADIUS_KM * np.arccos(np.clip(cos_angle, -1.0, 1.0))
+
+
+class GridIndex:
+    def __init__(self, ids, lats, lons, cell_km=1.0):
+        ids = np.asarray(ids)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        # 沒有座標的點無法參與距離計算，直接排除
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        self.ids = ids[valid]
+        self.lats = lats[valid]
+        self.lons = lons[valid]
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEG_LAT
+        # 所有點的 bounding box 四個角落，用來判斷搜尋半徑是否已涵蓋全部的點
+        if len(self.ids):
+            self._corner_lats = np.array([self.lats.min(), self.lats.min(), self.lats.max(), self.lats.max()])
+            self._corner_lons = np.array([self.lons.min(), self.lons.max(), self.lons.min(), self.lons.max()])
+
+        # 依網格座標排序，每個網格對應排序後陣列中的一段 [start, end)
+        cell_y = np.floor(self.lats / self.cell_deg).astype(np.int64)
+        cell_x = np.floor(self.lons / self.cell_deg).astype(np.int64)
+        self._order = np.lexsort((cell_x, cell_y))
+        cells = np.stack([cell_y[self._order], cell_x[self._order]], axis=1)
+        self._cells = {}
+        if len(cells):
+            boundaries = np.flatnonzero(np.any(cells[1:] != cells[:-1], axis=1)) + 1
+            starts = np.concatenate([[0], boundaries])
+            ends = np.concatenate([boundaries, [len(cells)]])
+            for start, end in zip(starts, ends):
+                self._cells[(cells[start, 0], cells[start, 1])] = (start, end)
+
+    @classmethod
+    def from_frame(cls, df, id_col, lat_col='latitude', lon_col='longitude', cell_km=1.0):
+        return cls(df[id_col].to_numpy(), df[lat_col].to_numpy(), df[lon_col].to_numpy(), cell_km=cell_km)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidates(self, lat, lon, radius_km):
+        # 半徑換算成經緯度的 bounding box，經度方向需依緯度修正
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlon = radius_km / (KM_PER_DEG_LAT * max(np.cos(np.radians(lat)), 1e-6))
+        y0, y1 = int(np.floor((lat - dlat) / self.cell_deg)), int(np.floor((lat + dlat) / self.cell_deg))
+        x0, x1 = int(np.floor((lon - dlon) / self.cell_deg)), int(np.floor((lon + dlon) / self.cell_deg))
+        chunks = []
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                span = self._cells.get((y, x))
+                if span:
+                    chunks.append(self._order[span[0]:span[1]])
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        positions = np.concatenate(chunks)
+        in_box = (
+            (np.abs(self.lats[positions] - lat) <= dlat)
+            & (np.abs(self.lons[positions] - lon) <= dlon)
+        )
+        return positions[in_box]
+
+    def query_radius(self, lat, lon, radius_km):
+        """回傳距離 (lat, lon) radius_km 公里內的點在索引中的位置與距離"""
+        if np.isnan(lat) or np.isnan(lon):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        positions = self._candidates(lat, lon, radius_km)
+        distances = distance_km(lat, lon, self.lats[positions], self.lons[positions])
+        within = distances <= radius_km
+        return positions[within], distances[within]
+
+    def nearest(self, lat, lon, k=1, max_km=None):
+        """回傳距離 (lat, lon) 最近的 k 個點 (限 max_km 公里內) 在索引中的位置與距離，由近到遠排序；k 為 None 時不限個數"""
+        if k is None:
+            k = len(self.ids)
+        if k <= 0 or not len(self.ids) or np.isnan(lat) or np.isnan(lon):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        # 半徑從一個網格開始加倍，半徑內已有 k 個點時，最近的 k 個點必定都在其中
+        farthest = distance_km(lat, lon, self._corner_lats, self._corner_lons).max()
+        limit = farthest if max_km is None else min(max_km, farthest)
+        radius = self.cell_km
+        while radius < limit:
+            positions, distances = self.query_radius(lat, lon, radius)
+            if len(positions) >= k:
+                break
+            radius *= 2
+        else:
+            if max_km is not None and max_km < farthest:
+                positions, distances = self.query_radius(lat, lon, max_km)
+            else:
+                # 半徑已涵蓋所有的點，直接計算全部的距離
+                positions = np.arange(len(self.ids))
+                distances = distance_km(lat, lon, self.lats, self.lons)
+        order = np.argsort(distances, kind='stable')[:k]
+        return positions[order], distances[order]
+
+    def nearest_pairs(self, ids, lats, lons, k=1, max_km=None, left_name='case_id', right_name='station_id'):
+        """批次查詢：每個 (id, lat, lon) 最近的 k 個點，rank 為由近到遠的名次 (從 1 開始)"""
+        ids = np.asarray(ids)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        left, right, dist, rank = [], [], [], []
+        for i in range(len(ids)):
+            positions, distances = self.nearest(lats[i], lons[i], k, max_km)
+            left.append(np.full(len(positions), i, dtype=np.int64))
+            right.append(positions)
+            dist.append(distances)
+            rank.append(np.arange(1, len(positions) + 1))
+        left = np.concatenate(left) if left else np.empty(0, dtype=np.int64)
+        right = np.concatenate(right) if right else np.empty(0, dtype=np.int64)
+        return pd.DataFrame({
+            left_name: ids[left],
+            right_name: self.ids[right],
+            'distance_km': np.concatenate(dist) if dist else np.empty(0),
+            'rank': np.concatenate(rank) if rank else np.empty(0, dtype=np.int64),
+        })
+
+    def pairs_within(self, ids, lats, lons, radius_km, left_name='case_id', right_name='station_id'):
+        """批次查詢：每個 (id, lat, lon) 與索引中 radius_km 公里內的點配對"""
+        ids = np.asarray(ids)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        left, right, dist = [], [], []
+        for i in range(len(ids)):
+            positions, distances = self.query_radius(lats[i], lons[i], radius_km)
+            left.append(np.full(len(positions), i, dtype=np.int64))
+            right.append(positions)
+            dist.append(distances)
+        left = np.concatenate(left) if left else np.empty(0, dtype=np.int64)
+        right = np.concatenate(right) if right else np.empty(0, dtype=np.int64)
+        dist = np.concatenate(dist) if dist else np.empty(0)
+        # 以原始陣列取值保留 id 的型別，即使沒有任何配對，DuckDB 也能正確推斷欄位型別
+        return pd.DataFrame({
+            left_name: ids[left],
+            right_name: self.ids[right],
+            'distance_km': dist,
+        })